@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011 TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+import os
+import bz2
+import shutil
+import logging
+import tempfile
+import unittest
+
+import yali.context as ctx
+import yali.pisiiface
+
+# (name, partOf, locales) of a small repository with known selections
+FIXTURE = [("baselayout", "system.base", []),
+           ("lvm2", "system.devel", []),
+           ("kernel", "kernel.default", []),
+           ("kernel-pae", "kernel.pae", []),
+           ("module-nvidia", "kernel.default.drivers", []),
+           ("module-pae-nvidia", "kernel.pae.drivers", []),
+           ("kdebase", "desktop.kde", []),
+           ("kde-l10n-tr", "desktop.kde", ["tr"]),
+           ("kde-l10n-de", "desktop.kde", ["de"]),
+           ("kde-l10n-en_GB", "desktop.kde", ["en_GB"]),
+           ("aspell-tr-de", "office", ["tr", "de"]),
+           ("firefox", None, [])]
+
+PARTS = ["system.base", "desktop.kde", "kernel.default", "kernel.pae",
+         "kernel.rt.drivers", "office", None]
+LOCALES = ["tr", "en", "en_GB", "de", "fr"]
+NAMES = ["lib", "app", "kernel", "lvm2", "yali", "xdm"]
+
+def makePackages(count=10000):
+    """Return (name, partOf, locales) tuples of a synthetic repository."""
+    packages = []
+    for i in range(count):
+        name = "%s-%05d" % (NAMES[i % len(NAMES)], i)
+        partOf = PARTS[(i / len(NAMES)) % len(PARTS)]
+        locales = []
+        if i % 5 == 0:
+            locales.append(LOCALES[(i / 5) % len(LOCALES)])
+        if i % 35 == 0:
+            locales.append("de")
+        packages.append((name, partOf, locales))
+    return packages
+
+def writeIndex(path, packages):
+    index = ["<PISI>"]
+    for name, partOf, locales in packages:
+        index.append("<Package><Name>%s</Name><PackageURI>%s-1.0-1-1.pisi</PackageURI>" % (name, name))
+        if partOf:
+            index.append("<PartOf>%s</PartOf>" % partOf)
+        for locale in locales:
+            index.append("<IsA>locale:%s</IsA>" % locale)
+        index.append("</Package>")
+    index.append("</PISI>")
+    bz2.BZ2File(path, "w").write("\n".join(index))
+
+class IndexTestCase(unittest.TestCase):
+    packages = []
+
+    def setUp(self):
+        if not ctx.logger:
+            ctx.logger = logging.getLogger("yali")
+        self.directory = tempfile.mkdtemp()
+        self.index = os.path.join(self.directory, "pisi-index.xml.bz2")
+        writeIndex(self.index, self.packages)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def selection(self, **keywords):
+        return yali.pisiiface.PackageSelection(self.index, **keywords)
+
+    def paths(self, names):
+        return set(yali.pisiiface.getPathsByPackageName(names, self.index))
+
+class PackageSelectionTestCase(IndexTestCase):
+    packages = FIXTURE
+
+    def testAll(self):
+        self.assertEqual(set(self.selection().select()),
+                         self.paths([name for name, partOf, locales in FIXTURE]))
+
+    def testLanguage(self):
+        self.assertEqual(set(self.selection(lang="tr").select()),
+                         self.paths(["baselayout", "lvm2", "kernel", "kernel-pae", "module-nvidia",
+                                     "module-pae-nvidia", "kdebase", "kde-l10n-tr", "kde-l10n-en_GB",
+                                     "firefox"]))
+
+    def testKernel(self):
+        self.assertEqual(set(self.selection(kernel=ctx.kernels[ctx.paeKernel]).select()),
+                         self.paths(["baselayout", "lvm2", "kernel-pae", "module-pae-nvidia", "kdebase",
+                                     "kde-l10n-tr", "kde-l10n-de", "kde-l10n-en_GB", "aspell-tr-de",
+                                     "firefox"]))
+
+    def testBaseOnly(self):
+        self.assertEqual(set(self.selection(lang="de", baseOnly=True).select()),
+                         self.paths(["baselayout", "lvm2", "kernel", "kernel-pae"]))
+        self.assertEqual(set(self.selection(kernel=ctx.kernels[ctx.defaultKernel], baseOnly=True).select()),
+                         self.paths(["baselayout", "lvm2", "kernel"]))
+
+    def testExcluded(self):
+        selection = self.selection(lang="tr")
+        cached = selection.select(exclude=False)
+        selection.exclude(["kdebase", "firefox", "module-nvidia"])
+        selection.include(["firefox"])
+        expected = self.paths(["baselayout", "lvm2", "kernel", "kernel-pae", "module-pae-nvidia",
+                               "kde-l10n-tr", "kde-l10n-en_GB", "firefox"])
+        self.assertEqual(set(selection.select()), expected)
+        self.assertEqual(set(selection.filter(cached)), expected)
+
+    def testContains(self):
+        selection = self.selection(lang="tr")
+        self.assertTrue(selection.contains(["kdebase", "kde-l10n-tr", "kde-l10n-en_GB"]))
+        self.assertFalse(selection.contains(["kdebase", "kde-l10n-de"]))
+        self.assertFalse(selection.contains(["missing"]))
+
+    def testBasePackages(self):
+        self.assertEqual(set(yali.pisiiface.getBasePackages(self.index)),
+                         self.paths(["baselayout", "lvm2", "kernel", "kernel-pae"]))
+
+class LargeIndexTestCase(IndexTestCase):
+    """Compare selections of a synthetic 10k package index with the per tag
+    lookups of getPackages and friends."""
+    packages = makePackages()
+
+    def lookup(self, tag, value):
+        return set(yali.pisiiface.mergePackagesWithRepoPath(
+                   yali.pisiiface.getPackages(tag, value, self.index)))
+
+    def testAll(self):
+        self.assertEqual(len(self.selection().select()), len(self.packages))
+
+    def testLanguage(self):
+        everything = set(self.selection().select())
+        notNeeded = set(yali.pisiiface.getNotNeededLanguagePackages(self.index))
+        self.assertTrue(notNeeded)
+        self.assertEqual(set(self.selection(lang=ctx.consts.lang).select()), everything - notNeeded)
+
+    def testKernel(self):
+        everything = set(self.selection().select())
+        kernels = self.lookup("PartOf", "kernel")
+        for type, flavour in ctx.kernels.items():
+            needed = set(yali.pisiiface.getNeededKernel(type, self.index))
+            self.assertEqual(set(self.selection(kernel=flavour).select()),
+                             (everything - kernels) | needed)
+
+    def testBaseOnly(self):
+        expected = self.lookup("PartOf", "system.base")
+        for name in yali.pisiiface.getBasePackageNames():
+            expected.update(self.lookup("Name", name))
+        self.assertEqual(set(yali.pisiiface.getBasePackages(self.index)), expected)
+
+    def testExcluded(self):
+        selection = self.selection()
+        cached = selection.select(exclude=False)
+        excluded = [name for name, partOf, locales in self.packages[:300]]
+        selection.exclude(excluded)
+        expected = set(cached) - self.paths(excluded)
+        self.assertEqual(set(selection.select()), expected)
+        self.assertEqual(set(selection.filter(cached)), expected)
+
+if __name__ == "__main__":
+    unittest.main()
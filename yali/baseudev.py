@@ -49,6 +49,26 @@ def udev_get_device(sysfs_path):
 
     return dev
 
+def udev_get_devices_by_path(sysfs_paths, deviceClass="block"):
+    """ Return udev entries of the given devices, None for vanished ones.
+
+        The entries are read in a single pass from the udev database if it
+        is available, otherwise device by device through libudev.
+    """
+    records = global_udev.snapshot_devices(["/sys" + path for path in sysfs_paths],
+                                           subsystem=deviceClass)
+    if records is None:
+        return [udev_get_device(path) for path in sysfs_paths]
+
+    for (sysfs_path, dev) in zip(sysfs_paths, records):
+        if dev is None:
+            ctx.logger.debug("%s does not exist" % sysfs_path)
+            continue
+        dev["name"] = dev.sysname
+        dev["sysfs_path"] = sysfs_path
+
+    return records
+
 def udev_get_devices(deviceClass="block"):
     udev_settle()
     entries = []
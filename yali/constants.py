@@ -71,6 +71,7 @@ class Constants:
         self.__c.target_dir = "/mnt/target"
         self.__c.session_file = os.path.join(self.__c.target_dir, "root/session.xml")
         self.__c.dbus_socket = "var/run/dbus/system_bus_socket"
+        self.__c.install_journal = "var/lib/yali/install.journal"
         self.__c.source_dir = os.path.join(self.__c.root_dir, "mnt/cdrom")
         self.__c.tmp_mnt_dir = os.path.join(self.__c.root_dir,"tmp/check")
         self.__c.repo_uri = os.path.join(self.__c.source_dir, "repo/pisi-index.xml.bz2")
@@ -83,6 +84,9 @@ class Constants:
         self.__c.pardus_repo_uri = "http://packages.pardus.org.tr/pardus-2009/pisi-index.xml.bz2"
         self.__c.pisi_index_file = os.path.join(self.__c.data_dir,"data/pisi-index.xml.bz2")
         self.__c.pisi_index_file_sum = os.path.join(self.__c.data_dir,"data/pisi-index.xml.bz2.sha1sum")
+        self.__c.root_image_dir = os.path.join(self.__c.source_dir, "images")
+        self.__c.validation_manifest = "/var/lib/yali/validation.manifest"
+        self.__c.package_set_dir = "/var/lib/yali/package-sets"
         self.__c.lang = locale.getdefaultlocale()[0][:2]
 
     def __getattr__(self, attr):
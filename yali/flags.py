@@ -77,6 +77,13 @@ class Flags:
         self.__dict__['flags']['live'] = False
         self.__dict__['flags']['dmraid'] = True
         self.__dict__['flags']['dryRun'] = False
+        self.__dict__['flags']['install_workers'] = 1
+        self.__dict__['flags']['image_install'] = False
+        self.__dict__['flags']['mirror'] = ""
+        self.__dict__['flags']['physical_order'] = False
+        self.__dict__['flags']['filesdb_batch'] = 64
+        self.__dict__['flags']['write_policy'] = "deferred"
+        self.__dict__['flags']['validation_manifest'] = ""
         self.__dict__['flags']['startup'] = 0
         self.__dict__['flags']['theme'] = ""
         self.__dict__['flags']['branding'] = ""
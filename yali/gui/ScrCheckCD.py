@@ -10,12 +10,15 @@
 # Please read the COPYING file.
 #
 
+from Queue import Empty
+
 import gettext
 _ = gettext.translation('yali', fallback=True).ugettext
 
 from PyQt4.Qt import QWidget, SIGNAL, QIcon, QPixmap
 
-import pisi.ui
+import pisi.util
+import yali.util
 import yali.context as ctx
 import yali.pisiiface
 from yali.gui import ScreenWidget
@@ -66,33 +69,43 @@ class Widget(QWidget, ScreenWidget):
         ctx.mainScreen.disableBack()
 
         ctx.interface.informationWindow.update(_("Starting validation..."))
-        class PisiUI(pisi.ui.UI):
-            def notify(self, event, **keywords):
-                pass
-            def display_progress(self, operation, percent, info, **keywords):
-                pass
-
-        yali.pisiiface.initialize(ui=PisiUI(), with_comar=False, nodestDir=True)
-        yali.pisiiface.addCdRepo()
         ctx.mainScreen.processEvents()
-        pkg_names = yali.pisiiface.getAvailablePackages()
-
-        self.ui.progressBar.setMaximum(len(pkg_names))
+        packages = yali.pisiiface.getValidationPackages(ctx.consts.cd_repo_uri)
+        manifestPath = ctx.flags.validation_manifest or ctx.consts.validation_manifest
+        manifest = yali.pisiiface.ValidationManifest(manifestPath,
+                                                     yali.util.get_iso_volume_id(ctx.consts.source_dir),
+                                                     pisi.util.sha1_file(ctx.consts.cd_repo_uri))
+        manifest.load()
+        paths = dict([(name, path) for name, path, hash in packages])
+        pending = [package for package in packages if not manifest.isValidated(package[0], package[1])]
+        ctx.logger.debug("%d of %d packages are already validated" % (len(packages) - len(pending), len(packages)))
+
+        self.ui.progressBar.setMaximum(len(packages))
 
         self.ui.checkLabel.setText(_("Package validation is in progress. "
                                      "Please wait until it is completed."))
-        cur = 0
+        validator = yali.pisiiface.PackageValidator(pending)
+        validator.start()
+        cur = len(packages) - len(pending)
+        self.ui.progressBar.setValue(cur)
         flag = 0
-        for pkg_name in pkg_names:
+        while validator.isAlive() or not validator.results.empty():
+            try:
+                pkg_name, valid = validator.results.get(timeout=0.1)
+            except Empty:
+                ctx.mainScreen.processEvents()
+                continue
+
             cur += 1
             ctx.logger.debug("Validating %s " % pkg_name)
             ctx.interface.informationWindow.update(_("Validating %s") % pkg_name)
             if self.check_media_stop:
+                validator.stop()
                 continue
-            try:
-                yali.pisiiface.checkPackageHash(pkg_name)
+            if valid:
+                manifest.add(pkg_name, paths[pkg_name])
                 self.ui.progressBar.setValue(cur)
-            except:
+            else:
                 rc  = ctx.interface.messageWindow(_("Warning"),
                                                   _("Validation of %s package failed."
                                                     "Please remaster your installation medium and"
@@ -102,6 +115,7 @@ class Widget(QWidget, ScreenWidget):
                                                   default=0)
                 flag = 1
                 if not rc:
+                    validator.stop()
                     self.ui.validationBox.hide()
                     self.ui.validationFailBox.show()
                     ctx.mainScreen.enableNext()
@@ -111,6 +125,8 @@ class Widget(QWidget, ScreenWidget):
                 else:
                     yali.util.reboot()
 
+        manifest.save()
+
         if not self.check_media_stop and flag == 0:
             ctx.interface.informationWindow.update(_('<font color="#FFF"><b>Validation succeeded. You can proceed with the installation.</b></font>'))
             self.ui.validationSucceedBox.show()
@@ -119,8 +135,6 @@ class Widget(QWidget, ScreenWidget):
             ctx.interface.informationWindow.hide()
             self.ui.progressBar.setValue(0)
 
-        yali.pisiiface.removeRepo(ctx.consts.cd_repo_name)
-
         ctx.mainScreen.enableNext()
         ctx.mainScreen.enableBack()
 
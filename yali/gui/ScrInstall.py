@@ -10,13 +10,14 @@
 # Please read the COPYING file.
 #
 import os
-from multiprocessing import Process, Queue
+import time
+from multiprocessing import Process, Pipe
 from Queue import Empty
 
 import gettext
 _ = gettext.translation('yali', fallback=True).ugettext
 
-from PyQt4.Qt import QWidget, SIGNAL, QPixmap, QObject, QTimer, QMutex, QWaitCondition
+from PyQt4.Qt import QWidget, SIGNAL, QPixmap, QObject, QTimer, QMutex, QWaitCondition, QSocketNotifier
 
 import pisi.ui
 
@@ -30,7 +31,7 @@ from yali.gui.Ui.installwidget import Ui_InstallWidget
 from yali.gui.Ui.installprogress import Ui_InstallProgress
 from pds.gui import PAbstractBox, BOTCENTER
 
-EventConfigure, EventInstall, EventSetProgress, EventError, EventAllFinished, EventPackageInstallFinished, EventRetry = range(1001, 1008)
+EventConfigure, EventInstall, EventSetProgress, EventError, EventAllFinished, EventPackageInstallFinished, EventRetry, EventImageProgress = range(1001, 1009)
 
 class InstallProgressWidget(PAbstractBox):
 
@@ -66,6 +67,33 @@ class InstallProgressWidget(PAbstractBox):
 
 
 
+class EventChannel(object):
+    """One way channel carrying installer events to the GUI.
+
+    Events are sent through a pipe, so the GUI can watch its reading end
+    with a QSocketNotifier and handle events as soon as they arrive.
+    """
+    def __init__(self):
+        self._reader, self._writer = Pipe(duplex=False)
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def put_nowait(self, data):
+        self._writer.send(data)
+
+    def get_nowait(self):
+        if not self._reader.poll():
+            raise Empty
+        return self._reader.recv()
+
+def formatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
 def iter_slideshows():
     slideshows = []
 
@@ -94,8 +122,7 @@ class Widget(QWidget, ScreenWidget):
         self.timer = QTimer(self)
         QObject.connect(self.timer, SIGNAL("timeout()"), self.changeSlideshows)
 
-        self.poll_timer = QTimer(self)
-        QObject.connect(self.poll_timer, SIGNAL("timeout()"), self.checkQueueEvent)
+        self.notifier = None
 
         if ctx.consts.lang == "tr":
             self.installProgress.ui.progress.setFormat("%%p")
@@ -117,6 +144,7 @@ class Widget(QWidget, ScreenWidget):
         self.retry_answer = False
         self.pkg_configurator = None
         self.pkg_installer = None
+        self.image = None
 
     def shown(self):
         # Disable mouse handler
@@ -128,12 +156,24 @@ class Widget(QWidget, ScreenWidget):
         ctx.logger.debug("PkgInstaller is creating...")
         self.mutex = QMutex()
         self.wait_condition = QWaitCondition()
-        self.queue = Queue()
-        self.pkg_installer = PkgInstaller(self.queue, self.mutex, self.wait_condition, self.retry_answer)
+        self.queue = EventChannel()
+        yali.util.defer_writes(ctx.flags.write_policy)
+        if ctx.flags.image_install:
+            if ctx.flags.collection:
+                self.image = yali.util.get_root_image(ctx.installData.autoCollection)
+            else:
+                self.image = yali.util.get_root_image()
+
+        if self.image:
+            ctx.logger.debug("Installing from root image %s" % self.image)
+            self.pkg_installer = ImageInstaller(self.queue, self.image)
+        else:
+            self.pkg_installer = PkgInstaller(self.queue, self.mutex, self.wait_condition, self.retry_answer)
 
-        self.poll_timer.start(500)
+        # handle installer events as soon as they arrive
+        self.notifier = QSocketNotifier(self.queue.fileno(), QSocketNotifier.Read, self)
+        QObject.connect(self.notifier, SIGNAL("activated(int)"), self.checkQueueEvent)
 
-        # start installer polling
         ctx.logger.debug("Calling PkgInstaller.start...")
         self.pkg_installer.start()
 
@@ -145,7 +185,7 @@ class Widget(QWidget, ScreenWidget):
 
         self.installProgress.showInstallProgress()
 
-    def checkQueueEvent(self):
+    def checkQueueEvent(self, fd=None):
 
         while True:
             try:
@@ -157,25 +197,35 @@ class Widget(QWidget, ScreenWidget):
             ctx.logger.debug("checkQueueEvent: Processing %s event..." % event)
             # EventInstall
             if event == EventInstall:
-                package = data[1]
-                self.installProgress.ui.info.setText(_("Installing <b>%(name)s</b> -- %(summary)s") % {"name":package.name,
-                                                                                       "summary":package.summary})
-                ctx.logger.debug("Pisi: %s installing" % package.name)
-                self.cur += 1
+                name, summary, weight, rate, eta = data[1:]
+                info = _("Installing <b>%(name)s</b> -- %(summary)s") % {"name":name,
+                                                                        "summary":summary}
+                if rate:
+                    info += "<br>" + _("%(rate).1f MB/s, %(eta)s remaining") % {"rate":rate / (1024 * 1024),
+                                                                                "eta":formatDuration(eta)}
+                self.installProgress.ui.info.setText(info)
+                ctx.logger.debug("Pisi: %s installing" % name)
+                self.cur += weight
                 self.installProgress.ui.progress.setValue(self.cur)
 
             # EventConfigure
             elif event == EventConfigure:
-                package = data[1]
-                self.installProgress.ui.info.setText(_("Configuring <b>%s</b>") % package.name)
-                ctx.logger.debug("Pisi: %s configuring" % package.name)
-                self.cur += 1
+                name, weight = data[1:]
+                self.installProgress.ui.info.setText(_("Configuring <b>%s</b>") % name)
+                ctx.logger.debug("Pisi: %s configuring" % name)
+                self.cur += weight
                 self.installProgress.ui.progress.setValue(self.cur)
 
+            # EventImageProgress
+            elif event == EventImageProgress:
+                self.installProgress.ui.info.setText(_("Extracting system image"))
+                self.installProgress.ui.progress.setValue(data[1])
+
             # EventSetProgress
             elif event == EventSetProgress:
-                total = data[1]
-                self.installProgress.ui.progress.setMaximum(total)
+                # Work left from the current position, sent again on retries
+                remaining = data[1]
+                self.installProgress.ui.progress.setMaximum(self.cur + remaining)
 
             # EventPackageInstallFinished
             elif event == EventPackageInstallFinished:
@@ -191,7 +241,7 @@ class Widget(QWidget, ScreenWidget):
             elif event == EventRetry:
                 package = os.path.basename(data[1])
                 self.timer.stop()
-                self.poll_timer.stop()
+                self.notifier.setEnabled(False)
                 rc = ctx.interface.messageWindow(_("Warning"),
                                                  _("Following error occured while "
                                                    "installing packages:"
@@ -203,7 +253,7 @@ class Widget(QWidget, ScreenWidget):
                 self.retry_answer = not rc
 
                 self.timer.start(1000 * 30)
-                self.poll_timer.start(500)
+                self.notifier.setEnabled(True)
                 self.wait_condition.wakeAll()
 
             # EventAllFinished
@@ -222,6 +272,14 @@ class Widget(QWidget, ScreenWidget):
     def packageInstallFinished(self):
         yali.postinstall.writeFstab()
 
+        if self.image:
+            # Root image is already configured, only machine specific settings are left
+            yali.util.writeLocaleFromCmdline()
+            yali.postinstall.writeInitramfsConf()
+            yali.util.start_dbus()
+            self.finished()
+            return
+
         # Configure Pending...
         # run baselayout's postinstall first
         yali.postinstall.initbaselayout()
@@ -242,11 +300,11 @@ class Widget(QWidget, ScreenWidget):
     def execute(self):
         # stop slide show
         self.timer.stop()
-        self.poll_timer.stop()
+        self.notifier.setEnabled(False)
         return True
 
     def finished(self):
-        self.poll_timer.stop()
+        self.notifier.setEnabled(False)
 
         if self.has_errors:
             return
@@ -255,6 +313,7 @@ class Widget(QWidget, ScreenWidget):
 
     def installError(self, error):
         self.has_errors = True
+        yali.util.flush_writes()
         errorstr = _("""An error occured during the installation of packages.
 This may be caused by a corrupted installation medium error:
 %s
@@ -274,7 +333,8 @@ class PkgInstaller(Process):
 
     def run(self):
         ctx.logger.debug("PkgInstaller is running.")
-        ui = PisiUI(self.queue)
+        sizes = yali.pisiiface.getInstalledSizes(ctx.packagesToInstall)
+        ui = PisiUI(self.queue, sizes)
         ctx.logger.debug("PisiUI is creating..")
         yali.pisiiface.initialize(ui)
         ctx.logger.debug("Pisi initialize is calling..")
@@ -286,16 +346,46 @@ class PkgInstaller(Process):
             ctx.logger.debug("CD Repo adding.")
             yali.pisiiface.addCdRepo()
 
-        # show progress
+        # Skip packages which were committed before an interruption
+        journal = yali.pisiiface.InstallJournal(ctx.packagesToInstall)
+        journal.load()
+        ui.journal = journal
+        pending = journal.pending()
+
+        # Write FilesDB in batches, adding entries lost by an interruption first
+        batch = yali.pisiiface.DatabaseBatch(journal, batch=ctx.flags.filesdb_batch)
+        batch.recover()
+        batch.start()
+
         total = len(ctx.packagesToInstall)
-        ctx.logger.debug("Sending EventSetProgress")
-        data = [EventSetProgress, total*2]
-        self.queue.put_nowait(data)
-        ctx.logger.debug("Found %d packages in repo.." % total)
+        configureWeight = sum([ui.weight(name) for name in sizes]) + total - len(sizes)
+        ctx.logger.debug("Found %d packages in repo, %d to install.." % (total, len(pending)))
         try:
             while True:
+                pending = journal.pending()
+                pendingSizes = yali.pisiiface.getInstalledSizes(pending)
+
+                # show progress weighted by installed sizes of pending packages and configure
+                # of all, a retry starts counting the packages left again
+                weight = sum([ui.weight(name) for name in pendingSizes]) + len(pending) - len(pendingSizes)
+                ctx.logger.debug("Sending EventSetProgress")
+                data = [EventSetProgress, weight + configureWeight]
+                self.queue.put_nowait(data)
+
+                ui.estimator = yali.pisiiface.ThroughputEstimator(sum(pendingSizes.values()))
+                if ctx.flags.mirror:
+                    # Download upcoming packages from the mirror while pisi installs
+                    prefetcher = yali.pisiiface.MirrorSource(ctx.flags.mirror, pending)
+                else:
+                    # Read upcoming packages from the medium while pisi installs
+                    prefetcher = yali.pisiiface.PackagePrefetcher(pending)
+                    ui.prefetcher = prefetcher
                 try:
-                    yali.pisiiface.install(ctx.packagesToInstall)
+                    prefetcher.start()
+                    if pending and ctx.flags.mirror:
+                        yali.pisiiface.installFromMirror(pending, prefetcher)
+                    elif pending:
+                        yali.pisiiface.install(pending)
                     break # while
                 except Exception, msg:
                     # Lock the mutex
@@ -311,12 +401,16 @@ class PkgInstaller(Process):
 
                     if not self.retry_answer:
                         raise msg
+                finally:
+                    prefetcher.stop()
 
         except Exception, msg:
             data = [EventError, msg]
             self.queue.put_nowait(data)
             # wait for the result
             self.wait_condition.wait(self.mutex)
+        finally:
+            batch.stop()
 
         ctx.logger.debug("Package install finished ...")
         # Package Install finished lets configure them
@@ -324,6 +418,32 @@ class PkgInstaller(Process):
         self.queue.put_nowait(data)
 
 
+class ImageInstaller(Process):
+
+    def __init__(self, queue, image):
+        Process.__init__(self)
+        self.queue = queue
+        self.image = image
+        ctx.logger.debug("ImageInstaller started.")
+
+    def progress(self, done):
+        data = [EventImageProgress, done / 1024]
+        self.queue.put_nowait(data)
+
+    def run(self):
+        ctx.logger.debug("ImageInstaller is running.")
+        try:
+            data = [EventSetProgress, os.path.getsize(self.image) / 1024]
+            self.queue.put_nowait(data)
+            yali.util.extract_root_image(self.image, ctx.consts.target_dir, self.progress)
+        except (yali.Error, EnvironmentError), msg:
+            data = [EventError, msg]
+            self.queue.put_nowait(data)
+
+        ctx.logger.debug("Image install finished ...")
+        data = [EventPackageInstallFinished]
+        self.queue.put_nowait(data)
+
 class PkgConfigurator(Process):
 
     def __init__(self, queue, mutex):
@@ -334,7 +454,7 @@ class PkgConfigurator(Process):
 
     def run(self):
         ctx.logger.debug("PkgConfigurator is running.")
-        ui = PisiUI(self.queue)
+        ui = PisiUI(self.queue, yali.pisiiface.getInstalledSizes(ctx.packagesToInstall))
         yali.pisiiface.initialize(ui=ui, with_comar=True)
 
         try:
@@ -344,6 +464,8 @@ class PkgConfigurator(Process):
         except Exception, msg:
             data = [EventError, msg]
             self.queue.put_nowait(data)
+        else:
+            yali.pisiiface.InstallJournal(ctx.packagesToInstall).remove()
 
        # Remove temporary repository and install add real
         if ctx.flags.collection:
@@ -356,22 +478,51 @@ class PkgConfigurator(Process):
 
 class PisiUI(pisi.ui.UI):
 
-    def __init__(self, queue):
+    def __init__(self, queue, sizes=None):
         pisi.ui.UI.__init__(self)
         self.queue = queue
+        self.sizes = sizes or {}
         self.last_package = ''
+        self.prefetcher = None
+        self.estimator = None
+        self.journal = None
+        self.configure_start = None
+
+    def weight(self, name):
+        # Progress is counted in KiB of installed size
+        return max(self.sizes.get(name, 0) / 1024, 1)
 
     def notify(self, event, **keywords):
         if event == pisi.ui.installing:
             ctx.logger.debug("PisiUI.notify event: Install")
-            data = [EventInstall, keywords['package']]
-            self.last_package = keywords['package'].name
+            if self.prefetcher:
+                # Raises if the package on the medium is corrupt
+                self.prefetcher.advance(keywords['package'].name)
+            rate = eta = None
+            if self.estimator:
+                # The previous package has been installed
+                if self.last_package:
+                    self.estimator.update(self.sizes.get(self.last_package, 0))
+                rate, eta = self.estimator.rate, self.estimator.remaining()
+            package = keywords['package']
+            data = [EventInstall, package.name, unicode(package.summary), self.weight(package.name), rate, eta]
+            self.last_package = package.name
             self.queue.put_nowait(data)
+        elif event == pisi.ui.installed:
+            if self.journal:
+                self.journal.commit(keywords['package'].name)
         elif event == pisi.ui.configuring:
             ctx.logger.debug("PisiUI.notify event: Configure")
-            data = [EventConfigure, keywords['package']]
-            self.last_package = keywords['package'].name
+            self.configure_start = time.time()
+            package = keywords['package']
+            data = [EventConfigure, package.name, self.weight(package.name)]
+            self.last_package = package.name
             self.queue.put_nowait(data)
+        elif event == pisi.ui.configured:
+            if self.configure_start:
+                ctx.logger.debug("Pisi: %s configured in %.2f seconds" %
+                                 (keywords['package'].name, time.time() - self.configure_start))
+                self.configure_start = None
 
     def error(self, msg):
         ctx.logger.debug("PisiUI.error: %s" % unicode(msg))
@@ -16,6 +16,7 @@ _ = gettext.translation('yali', fallback=True).ugettext
 from PyQt4.Qt import QWidget, SIGNAL, QTimer, QString
 
 import yali.util
+import yali.pisiiface
 import yali.context as ctx
 import yali.storage
 import yali.users
@@ -231,24 +232,37 @@ class Widget(QWidget, ScreenWidget):
     def createPackageList(self):
         ctx.logger.debug("Generating package list...")
 
+        index = None
         if ctx.flags.collection:
-            # Get only collection packages with collection Name
-            packages = yali.pisiiface.getAllPackagesWithPaths(
-                        collectionIndex=ctx.installData.autoCollection.index)
+            setName = ctx.installData.autoCollection.id
+            index = ctx.installData.autoCollection.index
+        elif ctx.flags.baseonly:
+            setName = "base-%d" % ctx.flags.install_type
         else:
-            # Check for just installing system.base packages
-            if ctx.flags.baseonly:
-                packages = yali.pisiiface.getBasePackages()
-            else:
-                packages = yali.pisiiface.getAllPackagesWithPaths()
+            setName = "all"
+
+        # Collection packages or just system.base packages without extra languages
+        selection = yali.pisiiface.PackageSelection(index, lang=ctx.consts.lang,
+                                                    baseOnly=ctx.flags.baseonly and not ctx.flags.collection)
+        self.filterDriverPacks(selection)
 
-        # Check for extra languages
-        packages = list(set(packages) - set(yali.pisiiface.getNotNeededLanguagePackages()))
-        ctx.logger.debug("Not needed lang packages will not be installing...")
+        packages = yali.pisiiface.getPackageSet(setName, ctx.consts.lang, index)
+        if packages is None:
+            # Package sets do not depend on the hardware, drivers are filtered below
+            packages = selection.select(exclude=False)
+            yali.pisiiface.savePackageSet(setName, ctx.consts.lang, packages, index)
 
-        packages = self.filterDriverPacks(packages)
+        packages = selection.filter(packages)
         packages.sort()
 
+        # Order packages by dependency levels if install_workers is above 1
+        scheduler = yali.pisiiface.PackageScheduler(packages, workers=ctx.flags.install_workers)
+        if ctx.flags.physical_order:
+            # Follow the layout of the medium as far as dependencies allow
+            packages = scheduler.physicalOrder()
+        else:
+            packages = scheduler.order()
+
         # Place baselayout package on the top of package list
         baselayout = None
         for path in packages:
@@ -261,28 +275,26 @@ class Widget(QWidget, ScreenWidget):
 
         ctx.packagesToInstall = packages
 
-    def filterDriverPacks(self, paths):
+    def filterDriverPacks(self, selection):
         try:
             from panda import Panda
         except ImportError:
             ctx.logger.debug("Installing all driver packages since panda module is not installed.")
-            return paths
+            return
 
         panda = Panda()
 
         # filter all driver packages
-        foundDriverPackages = set(yali.pisiiface.getPathsByPackageName(panda.get_all_driver_packages()))
+        foundDriverPackages = set(panda.get_all_driver_packages())
         ctx.logger.debug("Found driver packages: %s" % foundDriverPackages)
-
-        allPackages = set(paths)
-        packages = allPackages - foundDriverPackages
+        selection.exclude(foundDriverPackages)
 
         # detect hardware
-        neededDriverPackages = set(yali.pisiiface.getPathsByPackageName(panda.get_needed_driver_packages()))
+        neededDriverPackages = set(panda.get_needed_driver_packages())
         ctx.logger.debug("Known driver packages for this hardware: %s" % neededDriverPackages)
 
         # if alternatives are available ask to user, otherwise return
-        if neededDriverPackages and neededDriverPackages.issubset(allPackages):
+        if neededDriverPackages and selection.contains(neededDriverPackages):
             answer = ctx.interface.messageWindow(
                     _("Proprietary Hardware Drivers"),
                     _("<qt>Proprietary drivers are available which may be required "
@@ -297,8 +309,6 @@ class Widget(QWidget, ScreenWidget):
                       customButtons=[_("Yes"), _("No")])
 
             if answer == 0:
-                packages.update(neededDriverPackages)
+                selection.include(neededDriverPackages)
                 ctx.blacklistedKernelModules.append(panda.get_blacklisted_module())
                 ctx.logger.debug("These driver packages will be installed: %s" % neededDriverPackages)
-
-        return list(packages)
@@ -12,17 +12,199 @@
 # PiSi module for YALI
 
 import os
+import sys
 import bz2
+import fcntl
+import Queue
+import bisect
 import lzma
 import time
 import glob
 import dbus
+import mmap
+import socket
+import struct
+import hashlib
+import httplib
+import urllib
+import urlparse
+import threading
+import multiprocessing
 import pisi
-import piksemel
+import yali
 import yali.context as ctx
 
+from xml.etree.cElementTree import iterparse
+
 repodb = pisi.db.repodb.RepoDB()
 
+class IndexReader(object):
+    """File-like reader returning the decompressed content of a bz2 or lzma
+    compressed index. Compressed data is read and decompressed in chunks,
+    so neither the compressed nor the decompressed file is held in memory.
+    Reads are served from the current chunk by an offset, which is copied
+    only when the next chunk is appended."""
+    chunkSize = 64 * 1024
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        if path.endswith("bz2"):
+            self._decompressor = bz2.BZ2Decompressor()
+        else:
+            self._decompressor = lzma.LZMADecompressor()
+        self._buffer = ""
+        self._offset = 0
+        self._eof = False
+
+    def _fill(self):
+        data = self._file.read(self.chunkSize)
+        if data:
+            data = self._decompressor.decompress(data)
+        else:
+            if hasattr(self._decompressor, "flush"):
+                data = self._decompressor.flush()
+            self._eof = True
+        if data:
+            self._buffer = self._buffer[self._offset:] + data
+            self._offset = 0
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) - self._offset < size):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer) - self._offset
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+def openIndex(path):
+    return IndexReader(path)
+
+class IndexPackage(object):
+    """Tag data of a single Package node of a repository index."""
+    __slots__ = ("name", "uri", "partOf", "isA", "hash", "dependencies", "installedSize")
+
+    def __init__(self, name, uri, partOf=None, isA=None, hash=None, dependencies=None,
+                 installedSize=0):
+        self.name = name
+        self.uri = uri
+        self.partOf = partOf
+        self.isA = isA or []
+        self.hash = hash
+        self.dependencies = dependencies or []
+        self.installedSize = installedSize
+
+def iterIndexPackages(path):
+    """Yield an IndexPackage for every Package node of the index while it is
+    being decompressed. Each top level node is dropped once it is handled so
+    memory use is bounded by a single package node."""
+    reader = openIndex(path)
+    try:
+        root = None
+        depth = 0
+        for event, node in iterparse(reader, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = node
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+            if node.tag == "Package":
+                yield IndexPackage(node.findtext("Name"),
+                                   node.findtext("PackageURI"),
+                                   node.findtext("PartOf"),
+                                   [isA.text for isA in node.findall("IsA")],
+                                   node.findtext("PackageHash"),
+                                   [dependency.text for dependency in
+                                    node.findall("RuntimeDependencies/Dependency")],
+                                   int(node.findtext("InstalledSize") or 0))
+            root.clear()
+    finally:
+        reader.close()
+
+class PackageIndex(object):
+    """Repository index which is decompressed and parsed only once.
+
+    Package records are kept in memory and reused until the index file's
+    modification time or size changes on disk. While the index is streamed,
+    inverted indexes from Name, PartOf and IsA values to PackageURIs are built
+    so that lookups by tag do not walk every package again.
+    """
+    indexedTags = ("Name", "PartOf", "IsA")
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._packages = []
+        self._tags = {}
+        self._keys = {}
+
+    def stamp(self):
+        st = os.stat(self.path)
+        return (st.st_mtime, st.st_size)
+
+    def isStale(self):
+        return self._stamp is None or self._stamp != self.stamp()
+
+    def refresh(self):
+        if not self.isStale():
+            return
+
+        ctx.logger.debug("Parsing package index %s" % self.path)
+        stamp = self.stamp()
+        self._packages = []
+        self._tags = dict((tag, {}) for tag in self.indexedTags)
+        for package in iterIndexPackages(self.path):
+            self._packages.append(package)
+            for tag, values in (("Name", [package.name]),
+                                ("PartOf", [package.partOf]),
+                                ("IsA", package.isA)):
+                for value in values:
+                    if value:
+                        self._tags[tag].setdefault(value, []).append(package.uri)
+        self._keys = dict((tag, sorted(values)) for tag, values in self._tags.items())
+        self._stamp = stamp
+
+    def packages(self):
+        self.refresh()
+        return self._packages
+
+    def uri(self, name):
+        self.refresh()
+        uris = self._tags["Name"].get(name)
+        if uris:
+            return uris[0]
+        return None
+
+    def lookup(self, tag, prefix):
+        """Return (PackageURI, value) pairs of packages whose tag value starts
+        with prefix."""
+        self.refresh()
+        keys = self._keys[tag]
+        values = self._tags[tag]
+        result = []
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            for uri in values[keys[i]]:
+                result.append((uri, keys[i]))
+            i += 1
+        return result
+
+_indexes = {}
+
+def getIndex(path=None):
+    if not path:
+        path = os.path.join(ctx.consts.source_dir, "repo/pisi-index.xml.bz2")
+    if not _indexes.has_key(path):
+        _indexes[path] = PackageIndex(path)
+    return _indexes[path]
+
 def initialize(ui, with_comar = False, nodestDir = False):
     options = pisi.config.Options()
     ctx.logger.debug("Pisi initializing..")
@@ -92,92 +274,170 @@ def takeBack(operation):
 
 def getCollectionPackages(collectionIndex, kernels=False):
     ctx.logger.debug("index_path%s" % collectionIndex)
-    if collectionIndex.endswith("bz2"):
-        piksemelObj = piksemel.parseString(bz2.decompress(file(collectionIndex).read()))
-    else:
-        piksemelObj = piksemel.parseString(lzma.decompress(file(collectionIndex).read()))
     collectionPackages = []
-    for package in piksemelObj.tags("Package"):
+    for package in getIndex(collectionIndex).packages():
         # ignorekernel assignment changes kernel packages adding into package list
-        if kernels:
-            partof =  package.getTagData("PartOf")
-            # Get collection packages without all kernel components
-            if partof and partof.startswith("kernel"):
-                continue
-            else:
-                tagData = package.getTagData("PackageURI")
-        else:
-            tagData = package.getTagData("PackageURI")
-        collectionPackages.append(tagData)
+        # Get collection packages without all kernel components
+        if kernels and package.partOf and package.partOf.startswith("kernel"):
+            continue
+        collectionPackages.append(package.uri)
     return collectionPackages
 
-def getXmlObject(path):
-    if path.endswith("bz2"):
-        return piksemel.parseString(bz2.decompress(file(path).read()))
-    return piksemel.parseString(lzma.decompress(file(path).read()))
-
 def getPackages(tag=None, value=None, index=None):
-    if not index:
-        index = os.path.join(ctx.consts.source_dir, "repo/pisi-index.xml.bz2")
-    if index.endswith("bz2"):
-        piksemelObj = piksemel.parseString(bz2.decompress(file(index).read()))
-    else:
-        piksemelObj = piksemel.parseString(lzma.decompress(file(index).read()))
-    ret = []
-    for package in piksemelObj.tags("Package"):
-        tagData = package.getTagData(tag)
-        if tagData:
-            for node in package.tags(tag):
-                data = node.firstChild().data()
-                #if (not data.find(':') == -1 and data.startswith(value)) or (data.find(':') == -1 and data == value):
-                #Really don't understand why this control clauses used.
-                if data.startswith(value):
-                    ret.append("%s,%s" % (package.getTagData("PackageURI"), data))
-    return ret
+    return ["%s,%s" % (uri, data) for uri, data in getIndex(index).lookup(tag, value)]
 
-def getPathsByPackageName(packageNames, index=None):
-    if not index:
-        index = os.path.join(ctx.consts.source_dir, "repo/pisi-index.xml.bz2")
-    if index.endswith("bz2"):
-        piksemelObj = piksemel.parseString(bz2.decompress(file(index).read()))
-    else:
-        piksemelObj = piksemel.parseString(lzma.decompress(file(index).read()))
+def getRepoPaths(uris):
+    return [os.path.join(ctx.consts.source_dir, 'repo', uri) for uri in uris]
 
-    paths = []
-    for package in piksemelObj.tags("Package"):
-        for node in package.tags("Name"):
-            name = node.firstChild().data()
-            if name in packageNames:
-                uri = package.getTagData("PackageURI")
-                paths.append(os.path.join(ctx.consts.source_dir, 'repo', uri))
-    return paths
+def getPathsByPackageName(packageNames, index=None):
+    packageIndex = getIndex(index)
+    return getRepoPaths(filter(None, [packageIndex.uri(name) for name in packageNames]))
 
 def mergePackagesWithRepoPath(packages):
     return map(lambda x: os.path.join(ctx.consts.source_dir, 'repo', x.split(',')[0]), packages)
 
+_kernelFlavours = {}
+
+def getKernelFlavours(index=None):
+    """Return a mapping from the kernel types of ctx.kernels to the paths of
+    their packages. The mapping is built once per index file and reused until
+    the index changes on disk, so it can be queried on every selection."""
+    packageIndex = getIndex(index)
+    stamp = packageIndex.stamp()
+    cached = _kernelFlavours.get(packageIndex.path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    uris = dict((type, []) for type in ctx.kernels)
+    for uri, partOf in packageIndex.lookup("PartOf", "kernel"):
+        for type, flavour in ctx.kernels.items():
+            if partOf.startswith(flavour):
+                uris[type].append(uri)
+    flavours = dict((type, getRepoPaths(uris[type])) for type in uris)
+    _kernelFlavours[packageIndex.path] = (stamp, flavours)
+    return flavours
+
 def getNeededKernel(type, index):
-    return mergePackagesWithRepoPath(filter(lambda x: x.split(',')[1].startswith(ctx.kernels[type]), getPackages("PartOf", "kernel", index)))
-
-def getNotNeededLanguagePackages():
-    return mergePackagesWithRepoPath(filter(lambda x: not x.split(',')[1].split(':')[1].startswith((ctx.consts.lang, "en")), getPackages("IsA", "locale:")))
-
-def getBasePackages():
-    systemBase = getPackages("PartOf", "system.base")
-    systemBase.extend(getPackages("Name", "kernel"))
-    systemBase.extend(getPackages("Name", "gfxtheme-pardus-boot"))
-    systemBase.extend(getPackages("Name", "gfxtheme-base"))
-    systemBase.extend(getPackages("Name", "device-mapper"))
-    systemBase.extend(getPackages("Name", "lvm2"))
-    systemBase.extend(getPackages("Name", "lvm2-static"))
-    systemBase.extend(getPackages("Name", "device-mapper-static"))
-    systemBase.extend(getPackages("Name", "mdadm-static"))
+    return list(getKernelFlavours(index)[type])
+
+def getNotNeededLanguagePackages(index=None):
+    return getRepoPaths([uri for uri, isA in getIndex(index).lookup("IsA", "locale:")
+                         if not isA[len("locale:"):].startswith((ctx.consts.lang, "en"))])
+
+def getBasePackageNames():
+    names = ["kernel", "gfxtheme-pardus-boot", "gfxtheme-base", "device-mapper",
+             "lvm2", "lvm2-static", "device-mapper-static", "mdadm-static"]
     if ctx.flags.install_type == ctx.STEP_BASE:
-        systemBase.extend(getPackages("Name", "xdm"))
-        systemBase.extend(getPackages("Name", "yali"))
-        systemBase.extend(getPackages("Name", "yali-branding"))
-        systemBase.extend(getPackages("Name", "yali-theme"))
+        names.extend(["xdm", "yali", "yali-branding", "yali-theme"])
+    return names
+
+def getBasePackages(index=None):
+    return PackageSelection(index, baseOnly=True).select()
+
+class PackageSelection(object):
+    """Choose the packages to install with a single walk over the index.
+
+    All predicates are checked together for every package:
+        lang:     locale packages are kept for lang and English only
+        kernel:   kernel components are kept for one of ctx.kernels only
+        baseOnly: only system.base and the packages of getBasePackageNames,
+                  matched as name prefixes like getPackages does
+        excluded: names given to exclude(), e.g. unneeded driver packages
+    """
+    def __init__(self, index=None, lang=None, kernel=None, baseOnly=False):
+        self.index = getIndex(index)
+        self.lang = lang
+        self.kernel = kernel
+        self.baseOnly = baseOnly
+        self.baseNames = tuple(getBasePackageNames())
+        self.excluded = set()
+
+    def exclude(self, names):
+        self.excluded.update(names)
 
-    return mergePackagesWithRepoPath(systemBase)
+    def include(self, names):
+        self.excluded.difference_update(names)
+
+    def accepts(self, package):
+        partOf = package.partOf or ""
+        if self.baseOnly and not (partOf.startswith("system.base") or
+                                  package.name.startswith(self.baseNames)):
+            return False
+        if self.kernel and partOf.startswith("kernel") and not partOf.startswith(self.kernel):
+            return False
+        if self.lang:
+            for isA in package.isA:
+                if isA.startswith("locale:") and \
+                   not isA[len("locale:"):].startswith((self.lang, "en")):
+                    return False
+        return True
+
+    def contains(self, names):
+        """Return True if all named packages are in the index and accepted."""
+        packages = dict([(package.name, package) for package in self.index.packages()
+                         if package.name in names])
+        for name in names:
+            if not packages.has_key(name) or not self.accepts(packages[name]):
+                return False
+        return True
+
+    def select(self, exclude=True):
+        """Return paths of accepted packages. Excluded names are kept if
+        exclude is False, so that the result can be cached and filtered
+        later."""
+        uris = []
+        for package in self.index.packages():
+            if exclude and package.name in self.excluded:
+                continue
+            if self.accepts(package):
+                uris.append(package.uri)
+        return getRepoPaths(uris)
+
+    def filter(self, paths):
+        """Drop excluded packages from paths of an earlier select()."""
+        uris = set(filter(None, [self.index.uri(name) for name in self.excluded]))
+        return [path for path in paths if os.path.basename(path) not in uris]
+
+def getPackageSetFiles(name, lang):
+    fileName = "%s-%s.list" % (name, lang)
+    return [os.path.join(ctx.consts.source_dir, "repo/package-sets", fileName),
+            os.path.join(ctx.consts.package_set_dir, fileName)]
+
+def getPackageSet(name, lang, index=None):
+    """Return precomputed package paths of the named package set for lang.
+
+    Package sets are looked up on the installation medium first, then in
+    the local cache. A package set file starts with the mtime and size of
+    the index it was computed from, followed by one PackageURI per line.
+    None is returned if there is no package set for the current index.
+    """
+    mtime, size = getIndex(index).stamp()
+    stamp = "%d %d" % (mtime, size)
+    for path in getPackageSetFiles(name, lang):
+        try:
+            lines = open(path, "r").read().splitlines()
+        except IOError:
+            continue
+        if lines and lines[0] == stamp:
+            ctx.logger.debug("Using package set %s" % path)
+            return getRepoPaths(lines[1:])
+    return None
+
+def savePackageSet(name, lang, paths, index=None):
+    mtime, size = getIndex(index).stamp()
+    path = getPackageSetFiles(name, lang)[-1]
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        packageSet = open(path, "w")
+        packageSet.write("%d %d\n" % (mtime, size))
+        for uri in sorted([os.path.basename(p) for p in paths]):
+            packageSet.write("%s\n" % uri)
+        packageSet.close()
+    except (IOError, OSError), msg:
+        ctx.logger.debug("Writing package set %s failed: %s" % (path, msg))
+        return False
+    return True
 
 def getHistory(limit=50):
     pdb = pisi.db.historydb.HistoryDB()
@@ -195,9 +455,633 @@ def getHistory(limit=50):
 def finalize():
     pass
 
+def getDependencyLevels(items, dependencies):
+    """Group items so that every group only depends on items of earlier
+    groups. dependencies maps each item to the set of items it needs."""
+    levels = []
+    done = set()
+    remaining = list(items)
+    while remaining:
+        level = [item for item in remaining if dependencies[item].issubset(done)]
+        if not level:
+            # Dependency cycle, leave the rest in the given order
+            ctx.logger.debug("Dependency cycle between %d packages" % len(remaining))
+            level = remaining
+        levels.append(level)
+        done.update(level)
+        remaining = [item for item in remaining if item not in done]
+    return levels
+
+class PackageScheduler(object):
+    """Orders packages to be installed by their runtime dependencies.
+
+    The dependency graph is built from the repository index. levels() groups
+    the packages so that each group only depends on packages of earlier
+    groups; packages inside a group are independent of each other. Packages
+    are installed one at a time either way; workers is only a switch, with
+    workers of 1 the packages are kept in the given order.
+    """
+    def __init__(self, paths, index=None, workers=1):
+        self.paths = paths
+        self.index = index
+        self.workers = workers
+
+    def _dependencies(self):
+        packages = dict([(indexed.uri, indexed) for indexed in getIndex(self.index).packages()])
+        selected = {}
+        for path in self.paths:
+            package = packages.get(os.path.basename(path))
+            if package:
+                selected[path] = package
+
+        paths = dict([(selection.name, path) for path, selection in selected.items()])
+        dependencies = {}
+        for path in self.paths:
+            dependencies[path] = set()
+            if selected.has_key(path):
+                for name in selected[path].dependencies:
+                    if paths.has_key(name) and paths[name] != path:
+                        dependencies[path].add(paths[name])
+        return dependencies
+
+    def levels(self):
+        return getDependencyLevels(self.paths, self._dependencies())
+
+    def order(self):
+        if self.workers <= 1:
+            return list(self.paths)
+
+        order = []
+        for level in self.levels():
+            order.extend(level)
+        return order
+
+    def physicalOrder(self):
+        """Return the packages level by level, each level sorted by the
+        position of its packages on the medium so reads follow the disc."""
+        order = []
+        for level in self.levels():
+            order.extend(sorted(level, key=getFileOffset))
+        return order
+
+def getInstalledSizes(paths, index=None):
+    """Return installed sizes of the packages in bytes keyed by package name."""
+    packages = dict([(package.uri, package) for package in getIndex(index).packages()])
+    sizes = {}
+    for path in paths:
+        package = packages.get(os.path.basename(path))
+        if package:
+            sizes[package.name] = package.installedSize
+    return sizes
+
+class ThroughputEstimator(object):
+    """Smoothed throughput and remaining time of a job measured in bytes.
+
+    Progress is sampled at most once per interval seconds and the samples
+    are combined with an exponential moving average.
+    """
+    def __init__(self, total, interval=1.0, smoothing=0.3):
+        self.total = total
+        self.interval = interval
+        self.smoothing = smoothing
+        self.done = 0
+        self.rate = 0.0
+        self._sampled = 0
+        self._sampleTime = time.time()
+
+    def update(self, amount):
+        self.done += amount
+        now = time.time()
+        elapsed = now - self._sampleTime
+        if elapsed < self.interval:
+            return
+
+        current = (self.done - self._sampled) / elapsed
+        if self.rate:
+            self.rate = self.smoothing * current + (1 - self.smoothing) * self.rate
+        else:
+            self.rate = current
+        self._sampled = self.done
+        self._sampleTime = now
+
+    def remaining(self):
+        """Return estimated remaining seconds or None if not known yet."""
+        if not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+_verified = {}
+
+def isVerified(path):
+    """Return True if path was verified in this session and did not change."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return _verified.get(path) == (st.st_size, st.st_mtime)
+
+def setVerified(path):
+    st = os.stat(path)
+    _verified[path] = (st.st_size, st.st_mtime)
+
+class MediumReader(object):
+    """Reads packages from the installation medium without extra copies.
+
+    Packages are memory mapped, so hashing works directly on the page cache
+    and a read without a digest only faults the pages in. Files which can not
+    be mapped are read with readinto() into a buffer reused for every package.
+    A reader is not thread safe, every thread needs its own.
+    """
+    bufferSize = 1024 * 1024
+
+    def __init__(self):
+        self._buffer = None
+
+    def _readinto(self, package, digest):
+        if self._buffer is None:
+            self._buffer = bytearray(self.bufferSize)
+        view = memoryview(self._buffer)
+        while True:
+            count = package.readinto(self._buffer)
+            if not count:
+                break
+            if digest:
+                digest.update(view[:count])
+
+    def _touch(self, data, size, digest):
+        if digest:
+            digest.update(data)
+        else:
+            for offset in xrange(0, size, mmap.PAGESIZE):
+                data[offset]
+
+    def read(self, path, digest=None):
+        """Read path once, updating digest with its content if given."""
+        package = open(path, "rb")
+        try:
+            size = os.fstat(package.fileno()).st_size
+            if not size:
+                return
+            try:
+                data = mmap.mmap(package.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, EnvironmentError):
+                self._readinto(package, digest)
+            else:
+                try:
+                    self._touch(data, size, digest)
+                finally:
+                    data.close()
+        finally:
+            package.close()
+
+    def sha1(self, path):
+        digest = hashlib.sha1()
+        self.read(path, digest)
+        return digest.hexdigest()
+
+class PackageHashError(yali.Error):
+    pass
+
+class PackagePrefetcher(object):
+    """Reads package files ahead of the installer.
+
+    A background thread reads the packages in installation order, staying at
+    most window packages ahead of the package being installed, so pisi finds
+    them in the page cache instead of waiting for the medium. Packages not
+    verified in this session yet are hashed during the same read. The
+    installer calls advance() with the name of the package whenever it starts
+    installing the next one, which raises PackageHashError if the package
+    does not match the repository index.
+    """
+    def __init__(self, paths, window=8, index=None):
+        self.paths = paths
+        self.window = window
+        packages = getIndex(index).packages()
+        self.hashes = dict([(package.uri, package.hash) for package in packages])
+        self.uris = dict([(package.name, package.uri) for package in packages])
+        self.basenames = dict([(os.path.basename(path), path) for path in paths])
+        self._current = 0
+        self._next = 0
+        self._stopped = False
+        self._reading = set()
+        self._read = set()
+        self._failed = {}
+        self._reader = MediumReader()
+        self._condition = threading.Condition()
+
+    def _fetch(self, reader, path):
+        """Read path, returning an error message if it does not match its hash."""
+        try:
+            if isVerified(path):
+                reader.read(path)
+                return None
+
+            if reader.sha1(path) != self.hashes.get(os.path.basename(path)):
+                return "Package %s does not match its hash in the repository index" % path
+            setVerified(path)
+        except (IOError, OSError), msg:
+            # pisi reports packages it can not read itself
+            ctx.logger.debug("Prefetching %s failed: %s" % (path, msg))
+        return None
+
+    def _prefetch(self):
+        reader = MediumReader()
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._stopped and self._next > self._current + self.window:
+                    self._condition.wait()
+                if self._stopped or self._next >= len(self.paths):
+                    return
+                path = self.paths[self._next]
+                self._next += 1
+                self._reading.add(path)
+            finally:
+                self._condition.release()
+
+            error = self._fetch(reader, path)
+
+            self._condition.acquire()
+            self._reading.discard(path)
+            self._read.add(path)
+            if error:
+                self._failed[path] = error
+            self._condition.notifyAll()
+            self._condition.release()
+
+    def start(self):
+        # A single reader, concurrent reads make the medium seek
+        prefetcher = threading.Thread(target=self._prefetch)
+        prefetcher.daemon = True
+        prefetcher.start()
+
+    def advance(self, name=None):
+        """Move the window on to the next package. If the package named is
+        not read yet, it is checked in the calling thread."""
+        self._condition.acquire()
+        try:
+            self._current += 1
+            self._condition.notifyAll()
+            path = self.basenames.get(self.uris.get(name))
+            if path is None:
+                return
+            while path in self._reading:
+                self._condition.wait()
+            error = self._failed.pop(path, None)
+            read = path in self._read
+        finally:
+            self._condition.release()
+
+        if not read:
+            error = self._fetch(self._reader, path)
+        if error:
+            ctx.logger.error(error)
+            raise PackageHashError(error)
+
+    def stop(self):
+        self._condition.acquire()
+        self._stopped = True
+        self._condition.notifyAll()
+        self._condition.release()
+
+def syncFile(path):
+    """Write the data of path to disk, whatever the writeback settings."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class InstallJournal(object):
+    """Checkpoint journal of packages committed to the target system.
+
+    Every package is recorded as soon as pisi reports it installed, so an
+    interrupted installation can resume from the first uncommitted package.
+    The journal starts with a checksum of the package list and is ignored if
+    it was written for another package list. Packages written to FilesDB are
+    recorded with a "+" once FilesDB is on disk, and those lines are synced,
+    so a package is never taken as flushed when its files are lost.
+    """
+    def __init__(self, paths, path=None):
+        self.paths = paths
+        self.path = path or os.path.join(ctx.consts.target_dir, ctx.consts.install_journal)
+        self.key = hashlib.sha1("\n".join(sorted([os.path.basename(p) for p in paths]))).hexdigest()
+        self.committed = set()
+        self.flushed = set()
+        self._loaded = False
+        self._journal = None
+
+    def load(self):
+        self.committed = set()
+        self.flushed = set()
+        self._loaded = False
+        try:
+            lines = open(self.path, "r").read().splitlines()
+        except IOError:
+            return False
+
+        if not lines or lines[0] != self.key:
+            ctx.logger.debug("Ignoring install journal %s of another package list" % self.path)
+            return False
+
+        self.committed = set([line for line in lines[1:] if not line.startswith("+")])
+        self.flushed = set([line[1:] for line in lines[1:] if line.startswith("+")])
+        self._loaded = True
+        ctx.logger.debug("%d packages are already installed" % len(self.committed))
+        return True
+
+    def pending(self, index=None):
+        names = dict([(package.uri, package.name) for package in getIndex(index).packages()])
+        return [path for path in self.paths if names.get(os.path.basename(path)) not in self.committed]
+
+    def _write(self, lines, sync=False):
+        if self._journal is None:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            if self._loaded:
+                self._journal = open(self.path, "a")
+            else:
+                self._journal = open(self.path, "w")
+                self._journal.write("%s\n" % self.key)
+                self._loaded = True
+        for line in lines:
+            self._journal.write("%s\n" % line)
+        self._journal.flush()
+        if sync:
+            os.fsync(self._journal.fileno())
+
+    def commit(self, name):
+        self._write([name])
+        self.committed.add(name)
+
+    def unflushed(self):
+        """Return committed packages whose files are not in FilesDB yet."""
+        return sorted(self.committed - self.flushed)
+
+    def markFlushed(self, names):
+        self._write(["+%s" % name for name in names], sync=True)
+        self.flushed.update(names)
+
+    def remove(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class DatabaseBatch(object):
+    """Collect FilesDB updates of pisi and write them in batches.
+
+    pisi adds the files of every installed package to FilesDB on its own,
+    which costs a database write per package. While started, the updates
+    are kept in memory and written every batch packages. Written packages
+    are recorded in the journal; committed packages missing there, e.g.
+    after a crash, are added again from their files.xml by recover().
+    """
+    def __init__(self, journal=None, batch=64):
+        self.journal = journal
+        self.batch = batch
+        self._pending = []
+        self._addFiles = None
+
+    def start(self):
+        if self._addFiles is not None or self.batch <= 0:
+            return
+        self._addFiles = pisi.db.filesdb.FilesDB.add_files
+        batch = self
+        def add_files(filesdb, pkg, files):
+            batch.add(pkg, files)
+        pisi.db.filesdb.FilesDB.add_files = add_files
+
+    def stop(self):
+        self.flush()
+        if self._addFiles is not None:
+            pisi.db.filesdb.FilesDB.add_files = self._addFiles
+            self._addFiles = None
+
+    def add(self, name, files):
+        self._pending.append((name, files))
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        start = time.time()
+        filesdb = pisi.db.filesdb.FilesDB()
+        addFiles = self._addFiles or pisi.db.filesdb.FilesDB.add_files
+        for name, files in self._pending:
+            addFiles(filesdb, name, files)
+        shelf = getattr(filesdb, "filesdb", None)
+        if hasattr(shelf, "sync"):
+            shelf.sync()
+        # The journal must not get ahead of FilesDB on disk, packages not
+        # marked are added again by recover()
+        synced = True
+        try:
+            syncFile(os.path.join(pisi.context.config.info_dir(), pisi.context.const.files_db))
+        except OSError, msg:
+            ctx.logger.debug("Syncing FilesDB failed: %s" % msg)
+            synced = False
+        names = [name for name, files in self._pending]
+        self._pending = []
+        if self.journal and synced:
+            self.journal.markFlushed(names)
+        ctx.logger.debug("Wrote files of %d packages to FilesDB in %.2f seconds" %
+                         (len(names), time.time() - start))
+
+    def recover(self):
+        if not self.journal:
+            return
+        installdb = pisi.db.installdb.InstallDB()
+        for name in self.journal.unflushed():
+            if installdb.has_package(name):
+                self._pending.append((name, installdb.get_files(name)))
+        if self._pending:
+            ctx.logger.debug("Recovering FilesDB entries of %d packages" % len(self._pending))
+        self.flush()
+
+class MirrorError(yali.Error):
+    pass
+
+class ConnectionPool(object):
+    """Keep-alive HTTP connections to a single host."""
+    def __init__(self, host, port=None, size=4, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        self._lock.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+        finally:
+            self._lock.release()
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def put(self, connection):
+        """Keep connection for reuse. Connections returned by downloads
+        still running when the pool is closed are closed as well."""
+        self._lock.acquire()
+        try:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for connection in idle:
+            connection.close()
+
+class MirrorSource(object):
+    """Downloads packages from an HTTP mirror of the repository.
+
+    Worker threads download the packages in installation order over pooled
+    keep-alive connections, staying at most ahead packages in front of the
+    installer. Package hashes from the repository index are checked while the
+    data arrives. wait() returns the local path of a package once it is
+    downloaded and verified.
+    """
+    chunkSize = 64 * 1024
+
+    def __init__(self, url, paths, destination=None, workers=4, ahead=32, index=None):
+        url = urlparse.urlsplit(url)
+        if url.scheme != "http":
+            raise MirrorError("Unsupported mirror URL %s" % url.geturl())
+        self.basePath = url.path.rstrip("/")
+        self.pool = ConnectionPool(url.hostname, url.port, workers)
+        self.paths = paths
+        self.positions = dict([(path, position) for (position, path) in enumerate(paths)])
+        self.destination = destination or os.path.join(ctx.consts.target_dir, "var/cache/pisi/packages")
+        self.workers = workers
+        self.ahead = ahead
+        self.hashes = dict([(package.uri, package.hash) for package in getIndex(index).packages()])
+        self._next = 0
+        self._waiting = 0
+        self._stopped = False
+        self._results = {}
+        self._condition = threading.Condition()
+
+    def fetch(self, uri):
+        path = os.path.join(self.destination, uri)
+        connection = self.pool.get()
+        try:
+            connection.request("GET", urllib.quote("%s/%s" % (self.basePath, uri)))
+            response = connection.getresponse()
+            if response.status != httplib.OK:
+                response.read()
+                raise MirrorError("Fetching %s failed: %d %s" % (uri, response.status, response.reason))
+
+            digest = hashlib.sha1()
+            package = open("%s.part" % path, "wb")
+            try:
+                while True:
+                    data = response.read(self.chunkSize)
+                    if not data:
+                        break
+                    digest.update(data)
+                    package.write(data)
+            finally:
+                package.close()
+        except (httplib.HTTPException, socket.error), msg:
+            connection.close()
+            raise MirrorError("Fetching %s failed: %s" % (uri, msg))
+        except:
+            connection.close()
+            raise
+        else:
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.put(connection)
+
+        if self.hashes.has_key(uri) and digest.hexdigest() != self.hashes[uri]:
+            os.unlink("%s.part" % path)
+            raise MirrorError("Hash of %s does not match the repository index" % uri)
+
+        os.rename("%s.part" % path, path)
+        return path
+
+    def _download(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._stopped and self._next >= self._waiting + self.ahead:
+                    self._condition.wait()
+                if self._stopped or self._next >= len(self.paths):
+                    return
+                path = self.paths[self._next]
+                self._next += 1
+            finally:
+                self._condition.release()
+
+            try:
+                result = self.fetch(os.path.basename(path))
+            except (MirrorError, IOError, OSError), msg:
+                result = MirrorError(str(msg))
+
+            self._condition.acquire()
+            self._results[path] = result
+            self._condition.notifyAll()
+            self._condition.release()
+
+    def start(self):
+        if not os.path.isdir(self.destination):
+            os.makedirs(self.destination)
+        for i in range(self.workers):
+            downloader = threading.Thread(target=self._download)
+            downloader.daemon = True
+            downloader.start()
+
+    def wait(self, path):
+        self._condition.acquire()
+        try:
+            self._waiting = max(self._waiting, self.positions[path] + 1)
+            self._condition.notifyAll()
+            while not self._stopped and not self._results.has_key(path):
+                self._condition.wait()
+            result = self._results.pop(path, None)
+        finally:
+            self._condition.release()
+
+        if isinstance(result, MirrorError):
+            raise result
+        if result is None:
+            raise MirrorError("Downloading %s was stopped" % path)
+        return result
+
+    def stop(self):
+        self._condition.acquire()
+        self._stopped = True
+        self._condition.notifyAll()
+        self._condition.release()
+        self.pool.close()
+
 def install(pkg_name_list):
     pisi.api.install(pkg_name_list, reinstall=False, ignore_file_conflicts=True)
 
+def installFromMirror(pkg_name_list, source, batch=16):
+    """Install packages batch by batch as they are downloaded by source."""
+    for i in range(0, len(pkg_name_list), batch):
+        packages = [source.wait(path) for path in pkg_name_list[i:i + batch]]
+        install(packages)
+        for package in packages:
+            os.unlink(package)
+
 #def getAllCollectionPackagesWithPaths(collectionName):
 #    packages = getCollectionPackages(collectionName)
 #    # Get packages with their full paths
@@ -231,16 +1115,194 @@ def configurePending():
     os.symlink("/", ctx.consts.target_dir + ctx.consts.target_dir)
     # Make baselayout configure first
     pisi.api.configure_pending(['baselayout'])
-    # And all of pending packages
+    # And all of pending packages, pisi orders them by their dependencies
+    start = time.time()
     pisi.api.configure_pending()
+    ctx.logger.debug("Configured pending packages in %.2f seconds" % (time.time() - start))
     os.unlink(ctx.consts.target_dir + ctx.consts.target_dir)
 
-def checkPackageHash(pkg_name):
-    repo_path = os.path.dirname(ctx.consts.cd_repo_uri)
+FIBMAP = 1
+
+def getFileOffset(path):
+    """Return the physical block holding the first byte of path. If the
+    block can not be queried, the inode number is used as an approximation
+    of the on-disk order. Missing files are placed last, so that reading
+    them fails where they are checked."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return struct.unpack("i", fcntl.ioctl(fd, FIBMAP, struct.pack("i", 0)))[0]
+        finally:
+            os.close(fd)
+    except (IOError, OSError):
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return sys.maxint
+
+def getValidationPackages(index=None):
+    """Return (name, path, hash) tuples of all packages in the index."""
+    return [(package.name, os.path.join(ctx.consts.source_dir, 'repo', package.uri), package.hash)
+            for package in getIndex(index).packages()]
+
+class PackageValidator(object):
+    """Checks package hashes of the installation medium.
+
+    A single reader thread reads the packages in their on-disk order, so the
+    medium is read sequentially, and hands their content to a pool of hashing
+    threads. Every result is put into the results queue as a (name, valid)
+    tuple as soon as it is ready.
+    """
+    chunkSize = 1024 * 1024
+    # chunks read ahead of the thread hashing a package
+    queuedChunks = 16
 
-    pkg = pisi.db.packagedb.PackageDB().get_package(pkg_name)
-    file_hash = pisi.util.sha1_file(
-        os.path.join(repo_path, pkg.packageURI))
+    def __init__(self, packages, workers=None):
+        self.results = Queue.Queue()
+        self.count = workers or multiprocessing.cpu_count()
+        self.packages = sorted(packages, key=lambda package: getFileOffset(package[1]))
+        self._jobs = Queue.Queue()
+        self._threads = []
+        self._stopped = False
+
+    def _readPackage(self, path, chunks):
+        try:
+            package = open(path, "rb")
+            try:
+                while True:
+                    if self._stopped:
+                        raise IOError("Validation was stopped")
+                    data = package.read(self.chunkSize)
+                    if not data:
+                        break
+                    chunks.put(data)
+            finally:
+                package.close()
+        except (IOError, OSError), msg:
+            chunks.put(msg)
+        chunks.put(None)
+
+    def _read(self):
+        try:
+            for name, path, hash in self.packages:
+                if self._stopped:
+                    break
+                if isVerified(path):
+                    self.results.put((name, True))
+                    continue
+                chunks = Queue.Queue(self.queuedChunks)
+                self._jobs.put((name, path, hash, chunks))
+                self._readPackage(path, chunks)
+        finally:
+            for i in range(self.count):
+                self._jobs.put(None)
+
+    def _hash(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            name, path, hash, chunks = job
+            digest = hashlib.sha1()
+            valid = True
+            while True:
+                data = chunks.get()
+                if data is None:
+                    break
+                elif isinstance(data, EnvironmentError):
+                    ctx.logger.debug("Validating %s failed: %s" % (path, data))
+                    valid = False
+                else:
+                    digest.update(data)
+
+            valid = valid and digest.hexdigest() == hash
+            if valid:
+                try:
+                    setVerified(path)
+                except OSError:
+                    pass
+            self.results.put((name, valid))
+
+    def start(self):
+        ctx.logger.debug("Validating packages with %d hashing threads" % self.count)
+        for target in [self._read] + [self._hash] * self.count:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # The reader stops at the next chunk, hashing threads when their
+        # current package is done
+        self._stopped = True
+
+    def isAlive(self):
+        return any(thread.isAlive() for thread in self._threads)
+
+class ValidationManifest(object):
+    """Packages which already passed validation on an installation medium.
+
+    The manifest is keyed by the medium's volume identifier and the hash of
+    its repository index and records the size and mtime of every validated
+    package file. A package only has to be hashed again if its file changed.
+    The content is stored with its SHA1 sum, damaged or foreign manifests are
+    ignored.
+    """
+    def __init__(self, path, volumeId, indexHash):
+        self.path = path
+        self.key = "%s %s" % (volumeId.replace(" ", "_") or "-", indexHash)
+        self._entries = {}
+
+    def _fileStamp(self, path):
+        st = os.stat(path)
+        return (st.st_size, int(st.st_mtime))
+
+    def load(self):
+        self._entries = {}
+        try:
+            lines = open(self.path, "r").read().splitlines()
+        except IOError:
+            return False
+
+        if len(lines) < 2:
+            return False
+
+        checksum, key, entries = lines[0], lines[1], lines[2:]
+        if hashlib.sha1("\n".join(lines[1:])).hexdigest() != checksum:
+            ctx.logger.debug("Validation manifest %s is corrupted" % self.path)
+            return False
+        if key != self.key:
+            ctx.logger.debug("Validation manifest %s belongs to another medium" % self.path)
+            return False
+
+        for entry in entries:
+            name, size, mtime = entry.split()
+            self._entries[name] = (int(size), int(mtime))
+        return True
+
+    def save(self):
+        lines = [self.key]
+        for name, (size, mtime) in sorted(self._entries.items()):
+            lines.append("%s %d %d" % (name, size, mtime))
+        content = "\n".join(lines)
+
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            manifest = open(self.path, "w")
+            manifest.write("%s\n%s" % (hashlib.sha1(content).hexdigest(), content))
+            manifest.close()
+        except (IOError, OSError), msg:
+            ctx.logger.debug("Writing validation manifest %s failed: %s" % (self.path, msg))
+            return False
+        return True
+
+    def isValidated(self, name, path):
+        try:
+            return self._entries.get(name) == self._fileStamp(path)
+        except OSError:
+            return False
 
-    if not pkg.packageHash == file_hash:
-        raise Exception
+    def add(self, name, path):
+        self._entries[name] = self._fileStamp(path)
@@ -173,12 +173,9 @@ def setupRepoIndex():
 
         # Extract the index
         pureIndex = file(os.path.join(target,"pisi-index.xml"),"w")
-        if ctx.consts.pisi_index_file.endswith("bz2"):
-            import bz2
-            pureIndex.write(bz2.decompress(open(ctx.consts.pisi_index_file).read()))
-        else:
-            import lzma
-            pureIndex.write(lzma.decompress(open(ctx.consts.pisi_index_file).read()))
+        compressedIndex = yali.pisiiface.openIndex(ctx.consts.pisi_index_file)
+        shutil.copyfileobj(compressedIndex, pureIndex)
+        compressedIndex.close()
         pureIndex.close()
 
         ctx.logger.debug("pisi index files copied.")
@@ -263,6 +260,8 @@ def teardownStorage():
     if ctx.flags.install_type == ctx.STEP_FIRST_BOOT:
         remove = True
     yali.util.backup_log(remove)
+    # Restore writeback settings even if bootloader installation was skipped
+    yali.util.flush_writes()
     ctx.storage.storageset.umountFilesystems()
     return not ctx.storage.storageset.active
 
@@ -280,6 +279,9 @@ def installBootloader():
         ctx.logger.debug("StorageSet is already active. Bootloader installBootloader failed")
         return False
 
+    # Everything installed must be on disk before the system is made bootable
+    yali.util.flush_writes()
+
     rc = ctx.bootloader.install()
     if rc:
         ctx.logger.debug("Bootloader installation failed")
@@ -110,6 +110,24 @@ libudev_udev_device_get_devlinks_list_entry.restype = c_void_p
 libudev_udev_device_get_devlinks_list_entry.argtypes = [ c_void_p ]
 
 
+# udev database directories of newer and older udev releases
+UDEV_DATA_DIRS = ["/run/udev/data", "/dev/.udev/data"]
+
+
+def split_property(name, value):
+    # lvm outputs values for multiple lvs in one line
+    # we want to split them and make a list
+    # if the first lv's value is empty we end up with a value starting
+    # with name=, prepend a space that our split does the right thing
+    if value.startswith("%s=" % name):
+        value = " " + value
+
+    if value.count(" %s=" % name):
+        value = value.split(" %s=" % name)
+
+    return value
+
+
 class UdevDevice(dict):
 
     def __init__(self, udev, sysfs_path):
@@ -145,17 +163,7 @@ class UdevDevice(dict):
             name = libudev_udev_list_entry_get_name(property_entry)
             value = libudev_udev_list_entry_get_value(property_entry)
 
-            # lvm outputs values for multiple lvs in one line
-            # we want to split them and make a list
-            # if the first lv's value is empty we end up with a value starting
-            # with name=, prepend a space that our split does the right thing
-            if value.startswith("%s=" % name):
-                value = " " + value
-
-            if value.count(" %s=" % name):
-                value = value.split(" %s=" % name)
-
-            self[name] = value
+            self[name] = split_property(name, value)
 
             # get next property entry
             property_entry = libudev_udev_list_entry_get_next(property_entry)
@@ -171,6 +179,82 @@ class UdevDevice(dict):
         libudev_udev_device_unref(udev_device)
 
 
+class UdevRecord(dict):
+    """ Properties of a device read from sysfs and the udev database.
+
+        Keys are the udev properties, overridden by the contents of the
+        device's uevent file, and "symlinks".
+    """
+    __slots__ = ("syspath", "sysname", "devpath", "subsystem", "devtype", "devnode")
+
+
+def find_data_dir():
+    for path in UDEV_DATA_DIRS:
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def read_uevent(sysfs_path):
+    uevent = {}
+    try:
+        f = open(os.path.join(sysfs_path, "uevent"))
+    except IOError:
+        return None
+
+    for line in f.read().splitlines():
+        (key, equals, value) = line.partition("=")
+        if equals:
+            uevent[key] = value
+    f.close()
+    return uevent
+
+
+def read_device_record(sysfs_path, subsystem, data_dir):
+    """ Return an UdevRecord of a device, or None if it does not exist. """
+    uevent = read_uevent(sysfs_path)
+    if uevent is None:
+        return None
+
+    record = UdevRecord()
+    record.syspath = sysfs_path
+    # like udev_device_get_sysname, e.g. cciss!c0d0 is cciss/c0d0
+    record.sysname = os.path.basename(sysfs_path).replace("!", "/")
+    record.devpath = sysfs_path[4:]
+    record.subsystem = subsystem
+    record.devtype = uevent.get("DEVTYPE")
+    record.devnode = None
+    symlinks = []
+
+    if uevent.has_key("MAJOR") and uevent.has_key("MINOR"):
+        prefix = {"block": "b"}.get(subsystem, "c")
+        try:
+            f = open(os.path.join(data_dir, "%s%s:%s" % (prefix, uevent["MAJOR"], uevent["MINOR"])))
+        except IOError:
+            # not handled by udev yet
+            f = None
+
+        if f:
+            for line in f.read().splitlines():
+                if line.startswith("E:"):
+                    (name, equals, value) = line[2:].partition("=")
+                    if equals:
+                        record[name] = split_property(name, value)
+                elif line.startswith("S:"):
+                    symlinks.append("/dev/%s" % line[2:])
+            f.close()
+
+    if uevent.has_key("DEVNAME"):
+        record.devnode = "/dev/%s" % uevent["DEVNAME"]
+    record["DEVPATH"] = record.devpath
+    record["SUBSYSTEM"] = subsystem
+    record["symlinks"] = symlinks
+
+    # the uevent file is authoritative, like for udev_parse_uevent_file
+    record.update(uevent)
+    return record
+
+
 class Udev(object):
 
     def __init__(self):
@@ -225,6 +309,20 @@ class Udev(object):
             if device:
                 yield device
 
+    def snapshot_devices(self, sysfs_paths, subsystem="block"):
+        """ Return records of the devices at sysfs_paths in one pass.
+
+            The properties are read from the uevent files and the udev
+            database directly instead of asking libudev device by device.
+            Records of vanished devices are None. None is returned if the
+            udev database can not be found.
+        """
+        data_dir = find_data_dir()
+        if data_dir is None:
+            return None
+
+        return [read_device_record(path, subsystem, data_dir) for path in sysfs_paths]
+
     def unref(self):
         libudev_udev_unref(self.udev)
         self.udev = None
@@ -191,6 +191,7 @@ class Storage(object):
         self.zeroMbr = None
         self.protectedDevSpecs = []
         self.autoPartitionRequests = []
+        self._views = {}
         self.defaultFSType = get_default_filesystem_type()
         self.defaultBootFSType = get_default_filesystem_type(boot=True)
         self.eddDict = {}
@@ -376,15 +377,27 @@ class Storage(object):
 
         return False
 
+    def _view(self, name, compute):
+        """ Return a copy of the named list of devices. The list is computed
+            again only if the device tree or the disk order changed since. """
+        tree = self.devicetree
+        cached = self._views.get(name)
+        if not cached or cached[0] is not tree or cached[1] != tree.generation or \
+           cached[2] is not self.eddDict:
+            cached = (tree, tree.generation, self.eddDict, compute())
+            self._views[name] = cached
+        return list(cached[3])
+
     @property
     def devices(self):
         """A list of all devices in the device tree."""
-        devices =  self.devicetree.devices
-        devices.sort(key=lambda d: d.name)
-        return devices
+        return sorted(self.devicetree.devices, key=lambda d: d.name)
 
     @property
     def drives(self):
+        return self._view("drives", self._drives)
+
+    def _drives(self):
         disks = self.disks
         partitioned = self.partitioned
         drives = [d.name for d in disks if d in partitioned]
@@ -401,6 +414,9 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
+        return self._view("disks", self._disks)
+
+    def _disks(self):
         disks = []
         for device in self.devicetree.devices:
             if device.isDisk:
@@ -448,9 +464,8 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        partitions = self.devicetree.getDevicesByInstance(Partition)
-        partitions.sort(key=lambda d: d.name)
-        return partitions
+        return self._view("partitions", lambda: sorted(self.devicetree.getDevicesByInstance(Partition),
+                                                       key=lambda d: d.name))
 
     @property
     def partitioned(self):
@@ -465,6 +480,9 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
+        return self._view("partitioned", self._partitioned)
+
+    def _partitioned(self):
         partitioned = []
         for device in self.devicetree.devices:
             if not device.partitioned:
@@ -487,9 +505,8 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        lvs = self.devicetree.getDevicesByType("lvmlv")
-        lvs.sort(key=lambda d: d.name)
-        return lvs
+        return self._view("lvs", lambda: sorted(self.devicetree.getDevicesByType("lvmlv"),
+                                                key=lambda d: d.name))
 
     @property
     def vgs(self):
@@ -499,9 +516,8 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        vgs = self.devicetree.getDevicesByType("lvmvg")
-        vgs.sort(key=lambda d: d.name)
-        return vgs
+        return self._view("vgs", lambda: sorted(self.devicetree.getDevicesByType("lvmvg"),
+                                                key=lambda d: d.name))
 
     @property
     def pvs(self):
@@ -511,10 +527,9 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        devices = self.devicetree.devices
-        pvs = [d for d in devices if d.format.type == "lvmpv"]
-        pvs.sort(key=lambda d: d.name)
-        return pvs
+        return self._view("pvs", lambda: sorted([d for d in self.devicetree.devices
+                                                 if d.format.type == "lvmpv"],
+                                                key=lambda d: d.name))
 
     @property
     def raidContainers(self):
@@ -532,9 +547,8 @@ class Storage(object):
             does not necessarily reflect the actual on-disk state of the
             system's disks.
         """
-        arrays = self.devicetree.getDevicesByType("mdarray")
-        arrays.sort(key=lambda d: d.name)
-        return arrays
+        return self._view("raidArrays", lambda: sorted(self.devicetree.getDevicesByType("mdarray"),
+                                                       key=lambda d: d.name))
 
     @property
     def raidMembers(self):
@@ -602,7 +616,13 @@ class Storage(object):
 
     @property
     def mountpoints(self):
-        return self.storageset.mountpoints
+        # mountpoints are set in place on formats, only the devices are cached
+        filesystems = {}
+        for device in self._view("mountable", lambda: [d for d in self.storageset.devices
+                                                       if d.format.mountable]):
+            if device.format.mountpoint:
+                filesystems[device.format.mountpoint] = device
+        return filesystems
 
     def deviceDeps(self, device):
         return self.devicetree.getDependentDevices(device)
@@ -17,6 +17,40 @@ class AbstractDevice(object):
     _id = 0
     _type = "abstract"
 
+    # attributes names, paths and uuids of a device are derived from,
+    # device trees are told when one of them is set
+    _indexedAttrs = frozenset(("_name", "parents", "sysfsPath", "uuid", "_format"))
+
+    def __setattr__(self, name, value):
+        if name == "_format":
+            # uuids and labels of formats are set in place
+            old = self.__dict__.get("_format")
+            if old is not None:
+                old.removeObserver(self._formatChanged)
+            if value is not None:
+                value.addObserver(self._formatChanged)
+        object.__setattr__(self, name, value)
+        if name in self._indexedAttrs:
+            self.notifyObservers()
+
+    def _formatChanged(self, format):
+        self.notifyObservers()
+
+    def addObserver(self, observer):
+        """ Call observer with this device when its identifiers change. """
+        observers = self.__dict__.setdefault("_observers", [])
+        if observer not in observers:
+            observers.append(observer)
+
+    def removeObserver(self, observer):
+        observers = self.__dict__.get("_observers", [])
+        if observer in observers:
+            observers.remove(observer)
+
+    def notifyObservers(self):
+        for observer in self.__dict__.get("_observers", []):
+            observer(self)
+
     def __init__(self, name, parents):
         self._name = name
         if parents is None:
@@ -42,7 +76,10 @@ class AbstractDevice(object):
         dont_copy_attrs = ('_raidSet',)
         shallow_copy_attrs = ('_partedDevice', '_partedPartition')
         for (attr, value) in self.__dict__.items():
-            if attr in dont_copy_attrs:
+            if attr == "_observers":
+                # the copy is not in any device tree
+                continue
+            elif attr in dont_copy_attrs:
                 setattr(new, attr, value)
             elif attr in shallow_copy_attrs:
                 setattr(new, attr, copy.copy(value))
@@ -72,6 +72,7 @@ class DMRaidArray(DeviceMapper):
 
         # we added it, so now set up the relations
         self.devices.append(device)
+        self.notifyObservers()
         device.addChild()
 
     @property
@@ -266,6 +266,7 @@ class RaidArray(Device):
 
         # we added it, so now set up the relations
         self.devices.append(device)
+        self.notifyObservers()
         device.addChild()
 
         device.setup()
@@ -292,6 +293,7 @@ class RaidArray(Device):
             raise ValueError("cannot remove non-member device from array")
 
         self.devices.remove(device)
+        self.notifyObservers()
         device.removeChild()
 
     @property
@@ -189,6 +189,7 @@ class VolumeGroup(DeviceMapper):
             raise ValueError("device is already a member of this VG")
 
         self.parents.append(device)
+        self.notifyObservers()
         device.addChild()
 
         # now see if the VG can be activated
@@ -205,6 +206,7 @@ class VolumeGroup(DeviceMapper):
         except ValueError, e:
             raise ValueError("cannot remove non-member PV device from VG")
 
+        self.notifyObservers()
         device.removeChild()
 
     def setup(self, intf=None, orig=False):
@@ -317,6 +319,7 @@ class VolumeGroup(DeviceMapper):
             raise VolumeGroupError("cannot add pv to existing vg", self.name)
 
         self.parents.append(pv)
+        self.notifyObservers()
         pv.addChild()
 
         # and update our pv count
@@ -332,6 +335,7 @@ class VolumeGroup(DeviceMapper):
             raise VolumeGroupError("cannot remove pv from existing vg", self.name)
 
         self.parents.remove(pv)
+        self.notifyObservers()
         pv.removeChild()
 
         # and update our pv count
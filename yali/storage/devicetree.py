@@ -26,6 +26,7 @@ from yali.storage.devices.logicalvolume import LogicalVolume
 from yali.storage.devices.disk import Disk
 from yali.storage.devices.opticaldevice import OpticalDevice
 from yali.storage.devices.partition import Partition
+from yali.storage.devices.filedevice import FileDevice
 from yali.storage import formats
 from yali.storage.formats.disklabel import InvalidDiskLabelError, DiskLabelCommitError
 from yali.storage.formats.filesystem import FilesystemError
@@ -40,6 +41,20 @@ class DeviceTree(object):
 
         self.intf = intf
         self._devices = []
+
+        # indexes of self._devices by their identifiers, see _indexDevice
+        self._names = {}
+        self._paths = {}
+        self._sysfsPaths = {}
+        self._uuids = {}
+        self._labels = {}
+        self._children = {}
+        self._indexed = {}
+        self._stale = {}
+        self._snapshot = None
+
+        # changes whenever devices are added, removed or changed
+        self.generation = 0
         self.operations = []
         self.exclusiveDisks = exclusive
         self.clearPartType = type
@@ -114,16 +129,20 @@ class DeviceTree(object):
 
             Raise ValueError if the device's identifier is already in the list.
         """
-        if device.path in [d.path for d in self._devices] and \
-           not isinstance(device, NoDevice):
+        if not isinstance(device, NoDevice) and \
+           [d for d in self._lookup(self._paths, device.path) if d.path == device.path]:
             raise ValueError("device is already in tree")
 
         # make sure this device's parent devices are in the tree already
         for parent in device.parents:
-            if parent not in self._devices:
+            if id(parent) not in self._indexed:
                 raise DeviceTreeError("parent device not in tree")
 
         self._devices.append(device)
+        self._snapshot = None
+        self.generation += 1
+        self._indexDevice(device)
+        device.addObserver(self._deviceChanged)
         ctx.logger.debug("added %s %s (id %d) to device tree" % (device.type, device.name, device.id))
 
     def _removeDevice(self, device, force=None, moddisk=True):
@@ -131,7 +150,7 @@ class DeviceTree(object):
 
             Only leaves may be removed.
         """
-        if device not in self._devices:
+        if id(device) not in self._indexed:
             raise ValueError("Device '%s' not in tree" % device.name)
 
         if not device.isleaf and not force:
@@ -157,6 +176,10 @@ class DeviceTree(object):
                     dev.updateName()
 
         self._devices.remove(device)
+        self._snapshot = None
+        self.generation += 1
+        device.removeObserver(self._deviceChanged)
+        self._unindexDevice(device)
         ctx.logger.debug("removed %s %s (id %d) from device tree" % (device.type,
                                                                      device.name,
                                                                      device.id))
@@ -164,6 +187,56 @@ class DeviceTree(object):
         for parent in device.parents:
             parent.removeChild()
 
+    def _deviceKeys(self, device):
+        """ Return (index, key) pairs a device is found by. """
+        keys = [(self._names, device.name),
+                (self._paths, device.path),
+                (self._sysfsPaths, getattr(device, "sysfsPath", None)),
+                (self._uuids, getattr(device, "uuid", None))]
+        format = getattr(device, "format", None)
+        if format:
+            keys.append((self._uuids, getattr(format, "uuid", None)))
+            keys.append((self._labels, getattr(format, "label", None)))
+        for parent in device.parents:
+            keys.append((self._children, id(parent)))
+        return [(index, key) for (index, key) in keys if key]
+
+    def _indexDevice(self, device):
+        keys = self._deviceKeys(device)
+        for (index, key) in keys:
+            index.setdefault(key, []).append(device)
+        self._indexed[id(device)] = keys
+
+    def _unindexDevice(self, device):
+        self._stale.pop(id(device), None)
+        for (index, key) in self._indexed.pop(id(device), []):
+            devices = index.get(key, [])
+            if device in devices:
+                devices.remove(device)
+            if not devices:
+                index.pop(key, None)
+
+    def _deviceChanged(self, device):
+        """ Reindex a device and its children, whose names may derive from
+            it, before the next lookup. """
+        if id(device) not in self._indexed:
+            # a copy of a device in the tree
+            return
+        self._stale[id(device)] = device
+        self._snapshot = None
+        self.generation += 1
+        for child in self._children.get(id(device), []):
+            self._stale[id(child)] = child
+
+    def _lookup(self, index, key):
+        """ Return devices indexed by key, reindexing changed devices first. """
+        while self._stale:
+            (dev_id, device) = self._stale.popitem()
+            if dev_id in self._indexed:
+                self._unindexDevice(device)
+                self._indexDevice(device)
+        return index.get(key, [])
+
     def addOperation(self, operation):
         """ Register an operation to be performed at a later time.
 
@@ -1617,17 +1690,11 @@ class DeviceTree(object):
             self.addDevice(device)
 
         # First iteration - let's just look for disks.
-        old_devices = {}
-        for device in devices:
-            old_devices[device['name']] = device
+        old_devices = set([device['sysfs_path'] for device in devices])
         while True:
-            devices = []
-            new_devices = udev_get_block_devices()
-
-            for new_device in new_devices:
-                if not old_devices.has_key(new_device['name']):
-                    old_devices[new_device['name']] = new_device
-                    devices.append(new_device)
+            # Only query devices appeared since the last pass
+            devices = udev_get_block_devices(known=old_devices)
+            old_devices.update([device['sysfs_path'] for device in devices])
 
             if len(devices) == 0:
                 # nothing is changing -- time to setup lvm lvs and scan them
@@ -1678,17 +1745,16 @@ class DeviceTree(object):
         if not name:
             return None
 
-        ctx.logger.debug("looking for device by name '%s'..." % name)
-
         found = None
-        for device in self._devices:
-            if device.name == name:
-                found = device
-                break
-            elif (device.type == "lvmlv" or device.type == "lvmvg") and \
-                    device.name == name.replace("--","-"):
-                found = device
-                break
+        for device in self._lookup(self._names, name):
+            found = device
+            break
+
+        if not found:
+            for device in self._lookup(self._names, name.replace("--","-")):
+                if device.type == "lvmlv" or device.type == "lvmvg":
+                    found = device
+                    break
 
         ctx.logger.debug("%s found by name is %s" % (name, found))
         return found
@@ -1697,14 +1763,9 @@ class DeviceTree(object):
         if not uuid:
             return None
 
-        ctx.logger.debug("looking for device by uuid '%s'..." % uuid)
-
         found = None
-        for device in self._devices:
-            if device.uuid == uuid:
-                found = device
-                break
-            elif device.format.uuid == uuid:
+        for device in self._lookup(self._uuids, uuid):
+            if device.uuid == uuid or device.format.uuid == uuid:
                 found = device
                 break
 
@@ -1726,15 +1787,9 @@ class DeviceTree(object):
         if not label:
             return None
 
-        ctx.logger.debug("looking for device by label '%s'..." % label)
-
         found = None
-        for device in self._devices:
-            _label = getattr(device.format, "label", None)
-            if not _label:
-                continue
-
-            if _label == label:
+        for device in self._lookup(self._labels, label):
+            if getattr(device.format, "label", None) == label:
                 found = device
                 break
 
@@ -1745,18 +1800,25 @@ class DeviceTree(object):
         if not path:
             return None
 
-        ctx.logger.debug("looking for device by path '%s'..." % path)
-
         found = None
-        for device in self._devices:
-            if device.path ==  path:
-                found = device
-                break
-            elif (device.type == "lvmlv" or device.type == "lvmvg") and \
-                    device.path == path.replace("--","-"):
+        for device in self._lookup(self._paths, path):
+            if device.path == path:
                 found = device
                 break
 
+        if not found:
+            for device in self._lookup(self._paths, path.replace("--","-")):
+                if device.type == "lvmlv" or device.type == "lvmvg":
+                    found = device
+                    break
+
+        if not found:
+            # paths of file devices change as their parents get mounted
+            for device in self._devices:
+                if isinstance(device, FileDevice) and device.path == path:
+                    found = device
+                    break
+
         ctx.logger.debug("%s found by path is %s" % (path, found))
         return found
 
@@ -1764,12 +1826,10 @@ class DeviceTree(object):
         if not sysfsPath:
             return None
 
-        ctx.logger.debug("looking for device '%s'..." % sysfsPath)
         found = None
-        for device in self._devices:
-            if device.sysfsPath == sysfsPath:
-                found = device
-                break
+        for device in self._lookup(self._sysfsPaths, sysfsPath):
+            found = device
+            break
 
         ctx.logger.debug("%s found by syspath is %s" % (sysfsPath, found))
         return found
@@ -1782,19 +1842,21 @@ class DeviceTree(object):
 
     def getChildren(self, device):
         """ Return a list of a device's children. """
-        return [c for c in self._devices if device in c.parents]
+        return [c for c in self._lookup(self._children, id(device)) if device in c.parents]
 
     @property
     def devices(self):
-        """ List of device instances """
-        devices = []
-        for device in self._devices:
-            if device.path in [d.path for d in devices] and \
-               not isinstance(device, NoDevice):
-                raise DeviceTreeError("duplicate paths in device tree")
-            devices.append(device)
-
-        return devices
+        """ Tuple of device instances, rebuilt only when the tree changes """
+        if self._snapshot is None:
+            paths = set()
+            for device in self._devices:
+                if device.path in paths and \
+                   not isinstance(device, NoDevice):
+                    raise DeviceTreeError("duplicate paths in device tree")
+                paths.add(device.path)
+            self._snapshot = tuple(self._devices)
+
+        return self._snapshot
 
     @property
     def uuids(self):
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import copy
 import gettext
 
 __trans = gettext.translation('yali', fallback=True)
@@ -123,6 +124,9 @@ class Format(object):
     _check = False
     _hidden = False                     # hide devices with this formatting?
 
+    # devices holding this format are told when one of these is set
+    _indexedAttrs = frozenset(("uuid", "label"))
+
     def __init__(self, *args, **kwargs):
         """ Create a Format instance.
 
@@ -139,6 +143,37 @@ class Format(object):
         self.options = kwargs.get("options")
         self._migrate = False
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._indexedAttrs:
+            self.notifyObservers()
+
+    def addObserver(self, observer):
+        """ Call observer with this format when its uuid or label changes. """
+        observers = self.__dict__.setdefault("_observers", [])
+        if observer not in observers:
+            observers.append(observer)
+
+    def removeObserver(self, observer):
+        observers = self.__dict__.get("_observers", [])
+        if observer in observers:
+            observers.remove(observer)
+
+    def notifyObservers(self):
+        for observer in self.__dict__.get("_observers", []):
+            observer(self)
+
+    def __deepcopy__(self, memo):
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        for (attr, value) in self.__dict__.items():
+            if attr == "_observers":
+                # the copy is not held by the same devices
+                continue
+            setattr(new, attr, copy.deepcopy(value, memo))
+
+        return new
+
     def __str__(self):
         s = ("%(classname)s instance (%(id)s) --\n"
              "  type = %(type)s  name = %(name)s  status = %(status)s\n"
@@ -62,7 +62,9 @@ class DiskLabel(Format):
         memo[id(self)] = new
         shallow_copy_attrs = ('_partedDevice', '_partedDisk', '_origPartedDisk')
         for (attr, value) in self.__dict__.items():
-            if attr in shallow_copy_attrs:
+            if attr == "_observers":
+                continue
+            elif attr in shallow_copy_attrs:
                 setattr(new, attr, copy.copy(value))
             else:
                 setattr(new, attr, copy.deepcopy(value, memo))
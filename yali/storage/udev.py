@@ -78,15 +78,24 @@ def udev_resolve_glob(glob):
 
     return ret
 
-def udev_get_block_devices():
-    # Wait for scsi adapters to be done with scanning their busses (#583143)
-    yali.util.run_batch("modprobe", ["scsi_wait_scan"])
-    yali.util.run_batch("rmmod", ["scsi_wait_scan"])
+def udev_get_block_devices(known=None):
+    """ Return udev entries of block devices.
+
+        If sysfs paths of already known devices are given, the busses are
+        not scanned again and entries are only created for devices which are
+        not known yet, e.g. ones appeared after activating md arrays or lvs.
+    """
+    if known is None:
+        # Wait for scsi adapters to be done with scanning their busses (#583143)
+        yali.util.run_batch("modprobe", ["scsi_wait_scan"])
+        yali.util.run_batch("rmmod", ["scsi_wait_scan"])
+        known = ()
     udev_settle()
     entries = []
-    for path in udev_enumerate_block_devices():
-        entry = udev_get_block_device(path)
-        if entry:
+    paths = [path for path in udev_enumerate_block_devices()
+             if path not in known]
+    for entry in udev_get_devices_by_path(paths):
+        if entry and entry.has_key("name"):
             if entry["name"].startswith("md"):
                 # mdraid is really braindead, when a device is stopped
                 # it is no longer usefull in anyway (and we should not
@@ -18,6 +18,7 @@ import stat
 import errno
 import time
 import dbus
+import tempfile
 import ConfigParser
 import gettext
 
@@ -462,10 +463,157 @@ def eject(mount_point=ctx.consts.source_dir):
     else:
         reboot()
 
+def get_mount_device(mount_point):
+    mount_point = os.path.normpath(mount_point)
+    for line in open("/proc/mounts", "r").readlines():
+        fields = line.split()
+        if len(fields) > 1 and fields[1] == mount_point:
+            return fields[0]
+    return None
+
+def get_iso_volume_id(mount_point=ctx.consts.source_dir):
+    """ Return volume identifier of the ISO9660 filesystem mounted on mount_point. """
+    device = get_mount_device(mount_point)
+    if not device:
+        return ""
+
+    try:
+        # Primary volume descriptor is on the 16th sector of 2048 bytes
+        f = open(device, "rb")
+        try:
+            f.seek(16 * 2048)
+            descriptor = f.read(2048)
+        finally:
+            f.close()
+    except IOError, msg:
+        ctx.logger.debug("Reading volume descriptor of %s failed: %s" % (device, msg))
+        return ""
+
+    if descriptor[1:6] != "CD001":
+        return ""
+
+    return descriptor[40:72].strip()
+
+def get_root_image(collection=None):
+    """ Return prebuilt root filesystem image of the collection if the medium has one. """
+    if collection:
+        name = collection.id
+    else:
+        name = "default"
+
+    for suffix in (".squashfs", ".tar", ".tar.gz", ".tar.bz2", ".tar.xz"):
+        path = os.path.join(ctx.consts.root_image_dir, name + suffix)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+def extract_root_image(image, target=ctx.consts.target_dir, progress=None):
+    """ Extract root filesystem image onto target.
+
+        Tar images are streamed to tar and progress, if given, is called
+        with the number of bytes read from the image so far.
+    """
+    ctx.logger.info("Extracting root image %s to %s" % (image, target))
+    if image.endswith(".squashfs"):
+        rc, out, error = run_batch("unsquashfs", ["-f", "-n", "-d", target, image])
+        if rc:
+            raise yali.Error("Extracting %s failed: %s" % (image, error))
+        if progress:
+            progress(os.path.getsize(image))
+        return
+
+    compression = {".gz":"z", ".bz2":"j", ".xz":"J"}.get(os.path.splitext(image)[1], "")
+    errors = tempfile.TemporaryFile()
+    try:
+        source = open(image, "rb")
+        tar = subprocess.Popen(["tar", "-x%spf" % compression, "-", "--numeric-owner", "-C", target],
+                               stdin=subprocess.PIPE, stderr=errors)
+    except EnvironmentError, msg:
+        raise yali.Error("Extracting %s failed: %s" % (image, msg))
+    done = 0
+    try:
+        while True:
+            data = source.read(1024 * 1024)
+            if not data:
+                break
+            tar.stdin.write(data)
+            done += len(data)
+            if progress:
+                progress(done)
+    except IOError, msg:
+        ctx.logger.error("Streaming %s failed: %s" % (image, msg))
+    source.close()
+    tar.stdin.close()
+
+    if tar.wait():
+        errors.seek(0)
+        raise yali.Error("Extracting %s failed: %s" % (image, errors.read()))
+
 def sync():
+    # sync(2) waits for the writeback on Linux, a single call is enough
     os.system("sync")
-    os.system("sync")
-    os.system("sync")
+
+# Writeback tunables used while writes to the target are deferred
+DEFERRED_WRITEBACK = {"dirty_ratio": "60",
+                      "dirty_background_ratio": "40",
+                      "dirty_expire_centisecs": "60000",
+                      "dirty_writeback_centisecs": "6000"}
+
+_saved_writeback = {}
+_saved_fsync = None
+
+def defer_writes(policy="deferred"):
+    """
+        Apply the durability policy of installation writes.
+
+        safe:     leave kernel writeback and fsync calls untouched
+        deferred: let dirty pages stay in memory longer and grow larger
+        unsafe:   deferred, and fsync calls of the installer are ignored
+
+        unsafe only replaces os.fsync and os.fdatasync of the Python
+        processes of YALI itself; package scripts run by COMAR in the
+        target chroot and other programs still sync as usual.
+
+        flush_writes() restores the defaults and writes everything out.
+        It can be called more than once.
+    """
+    global _saved_fsync
+    if policy not in ("deferred", "unsafe"):
+        return
+
+    for name, value in DEFERRED_WRITEBACK.items():
+        path = os.path.join("/proc/sys/vm", name)
+        try:
+            saved = open(path).read().strip()
+            open(path, "w").write(value)
+        except IOError, msg:
+            ctx.logger.debug("Setting %s failed: %s" % (path, msg))
+        else:
+            _saved_writeback.setdefault(name, saved)
+
+    if policy == "unsafe" and _saved_fsync is None:
+        _saved_fsync = (os.fsync, os.fdatasync)
+        os.fsync = os.fdatasync = lambda fd: None
+
+    ctx.logger.debug("Installation writes are %s" % policy)
+
+def flush_writes():
+    global _saved_fsync
+    if _saved_fsync is not None:
+        os.fsync, os.fdatasync = _saved_fsync
+        _saved_fsync = None
+
+    for name, value in _saved_writeback.items():
+        try:
+            open(os.path.join("/proc/sys/vm", name), "w").write(value)
+        except IOError, msg:
+            ctx.logger.debug("Restoring %s failed: %s" % (name, msg))
+    _saved_writeback.clear()
+
+    start = time.time()
+    sync()
+    ctx.logger.debug("Flushed installation writes in %.2f seconds" % (time.time() - start))
 
 def check_dual_boot():
     return isX86()